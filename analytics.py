@@ -0,0 +1,161 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import os
+import json
+import time
+import tempfile
+import urllib.parse
+import client
+from analytics_cache import parse_date
+from throttle import send
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Results can only be written as Parquet if pyarrow is installed
+    pyarrow = None
+
+# Fields returned by /Network/{hub}/analytics/system-usage that can be summed over users
+TOTAL_FIELDS = ('jobs', 'executions', 'queueTime', 'runTime')
+
+# (field returned by the API, CSV header, Parquet column) of every usage stat, in the order they are written. Rows
+# are built from this mapping, never from the order the API returns the fields in
+USAGE_COLUMNS = (
+    ('jobs', 'Jobs', 'jobs'),
+    ('executions', 'Executions', 'executions'),
+    ('queueTime', 'Queue Time (ms)', 'queue_time_ms'),
+    ('runTime', 'Run Time (ms)', 'run_time_ms'),
+    ('averageRunTime', 'Average Run Time (ms)', 'average_run_time_ms'),
+    ('averageQueueTime', 'Average Queue Time (ms)', 'average_queue_time_ms'),
+)
+
+'''
+Format for the data returned by /Network/{hub}/analytics/system-usage:
+    data: {
+        jobs: <int>,
+        executions: <int>,
+        queueTime: <int>,
+        runTime: <int>,
+        averageRunTime: <int>,
+        averageQueueTime: <int>
+    }
+'''
+
+
+def system_usage_url(hub, user_id, backend, start_date='', end_date=''):
+    '''Returns the url of the analytics of <user_id> on <backend> from <start_date> to <end_date>, or of all time if
+        either date is empty'''
+    if start_date == '' or end_date == '':
+        options = {"allTime": True, "backend": backend, "userId": user_id}
+    else:
+        options = {"startDate": start_date, "endDate": end_date, "backend": backend, "userId": user_id}
+
+    # Convert options into url friendly format
+    return f'{client.API_URL}/Network/{hub}/analytics/system-usage?options={urllib.parse.quote(json.dumps(options))}'
+
+
+def get_system_usage(bucket, hub, user_id, backend, start_date='', end_date='', cache=None):
+    '''Returns the analytics data of <user_id> on <backend> from <start_date> to <end_date>. The request is paced by
+        <bucket>. If an AnalyticsCache is given, saved results are reused and new ones are saved.'''
+    if cache is not None:
+        data = cache.get(hub, user_id, backend, start_date, end_date)
+        if data is not None:
+            return data
+
+    response = send(bucket, 'GET', system_usage_url(hub, user_id, backend, start_date, end_date))
+    response.raise_for_status()  # Checks if the request returned an error
+
+    data = response.json()["data"]
+    if cache is not None:
+        cache.put(hub, user_id, backend, start_date, end_date, data)
+
+    return data
+
+
+def add_totals(totals, data):
+    '''Adds the TOTAL_FIELDS of the analytics <data> to the <totals> list, in place. Missing fields count as 0'''
+    for idx, field in enumerate(TOTAL_FIELDS):
+        totals[idx] += data.get(field) or 0
+
+    return totals
+
+
+def usage_values(data):
+    '''Returns the values of the USAGE_COLUMNS in the analytics <data>, as integers. Missing fields are None'''
+    return [None if data.get(field) is None else int(round(data[field])) for field, _, _ in USAGE_COLUMNS]
+
+
+class UsageDataset:
+    '''Writes analytics results to a directory of Parquet files that can be read as one table, for example with
+        pyarrow.dataset or pandas.read_parquet.
+
+        Every run adds new part files, so earlier results are never rewritten. Rows are kept in memory until
+        BATCH_SIZE of them are ready, or FLUSH_INTERVAL seconds have passed since the last part file, then written
+        to a new part file in one step, so a part file is never seen half written. The usage stats are int64 and
+        the dates are date32, empty for all time ranges.'''
+    BATCH_SIZE = 10000
+    FLUSH_INTERVAL = 60
+
+    def __init__(self, path):
+        if pyarrow is None:
+            raise RuntimeError("pyarrow must be installed to write Parquet files. Run 'pip install pyarrow'")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.prefix = f'part-{time.strftime("%Y%m%d%H%M%S")}-{os.getpid()}'
+        self.parts = 0
+        self.schema = pyarrow.schema([pyarrow.field('hub', pyarrow.string()),
+                                      pyarrow.field('user', pyarrow.string()),
+                                      pyarrow.field('backend', pyarrow.string()),
+                                      pyarrow.field('start_date', pyarrow.date32()),
+                                      pyarrow.field('end_date', pyarrow.date32())] +
+                                     [pyarrow.field(column, pyarrow.int64()) for _, _, column in USAGE_COLUMNS])
+        self.rows = []
+        self.keys = []
+        self.flushed = time.monotonic()
+
+    def write(self, hub, user, backend, start_date, end_date, data, key=None):
+        '''Adds the row of a result. Returns the keys of the rows that were written to disk by this call, if the
+            batch was full or old enough'''
+        dates = [None, None] if start_date == '' or end_date == '' else [parse_date(start_date), parse_date(end_date)]
+        self.rows.append([hub, user, backend] + dates + usage_values(data))
+        self.keys.append(key)
+        if len(self.rows) >= self.BATCH_SIZE or time.monotonic() - self.flushed >= self.FLUSH_INTERVAL:
+            return self.flush()
+
+        return []
+
+    def flush(self):
+        '''Writes the rows kept in memory to a new part file. Returns their keys'''
+        self.flushed = time.monotonic()
+        if not self.rows:
+            return []
+
+        columns = list(zip(*self.rows))
+        table = pyarrow.Table.from_arrays([pyarrow.array(column, type=field.type)
+                                           for column, field in zip(columns, self.schema)], schema=self.schema)
+        # Hidden files are skipped by Parquet readers, so the part only shows up once it is complete
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+        os.close(fd)
+        try:
+            pyarrow.parquet.write_table(table, tmp_path)
+            os.replace(tmp_path, os.path.join(self.path, f'{self.prefix}-{self.parts:05d}.parquet'))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.parts += 1
+
+        keys = self.keys
+        self.rows = []
+        self.keys = []
+        return keys
+
+    def close(self):
+        return self.flush()
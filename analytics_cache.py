@@ -0,0 +1,94 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import os
+import json
+import time
+import sqlite3
+import datetime
+import threading
+import storage
+
+# Seconds the analytics of a date range that hasn't ended yet (or of all time) are reused
+OPEN_RANGE_TTL = int(os.environ.get('HUB_ANALYTICS_TTL', 3600))
+
+# Maximum number of results kept. The least recently used results are removed first
+MAX_ENTRIES = int(os.environ.get('HUB_ANALYTICS_CACHE_SIZE', 100000))
+
+
+def parse_date(date):
+    '''Converts a mm-dd-yy or mm-dd-yyyy string into a datetime.date. Two digit years are in the 2000s'''
+    month, day, year = map(int, date.split('-'))
+    if year < 100:
+        year += 2000
+
+    return datetime.date(year, month, day)
+
+
+def is_closed_range(start_date, end_date):
+    '''Returns True if the range has a start and an end, and the end is in the past. The analytics of such a range
+        will never change, so they can be kept forever'''
+    if start_date == '' or end_date == '':
+        return False
+    try:
+        return parse_date(end_date) < datetime.date.today()
+    except ValueError:
+        return False
+
+
+class AnalyticsCache:
+    '''SQLite cache of the analytics returned by /Network/{hub}/analytics/system-usage, keyed by
+        (hub, userId, backend, start, end). Safe to use from several threads and processes.'''
+
+    def __init__(self, path=None, open_range_ttl=OPEN_RANGE_TTL, max_entries=MAX_ENTRIES):
+        self.open_range_ttl = open_range_ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path or storage.cache_path('analytics.sqlite'), timeout=30,
+                                          check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS usage (hub TEXT, user_id TEXT, backend TEXT, '
+                                'start_date TEXT, end_date TEXT, data TEXT, expires REAL, used REAL, '
+                                'PRIMARY KEY (hub, user_id, backend, start_date, end_date))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS usage_used ON usage (used)')
+        self.evict()
+
+    def get(self, hub, user_id, backend, start_date, end_date):
+        '''Returns the cached analytics, or None if they aren't cached or have expired'''
+        key = (hub, user_id, backend, start_date, end_date)
+        with self.lock:
+            row = self.connection.execute('SELECT data, expires FROM usage WHERE hub = ? AND user_id = ? AND '
+                                          'backend = ? AND start_date = ? AND end_date = ?', key).fetchone()
+            if row is None or (row[1] is not None and row[1] < time.time()):
+                return None
+            self.connection.execute('UPDATE usage SET used = ? WHERE hub = ? AND user_id = ? AND backend = ? AND '
+                                    'start_date = ? AND end_date = ?', (time.time(),) + key)
+
+        return json.loads(row[0])
+
+    def put(self, hub, user_id, backend, start_date, end_date, data):
+        '''Stores the analytics of a request. Closed date ranges never expire, other ranges expire after
+            open_range_ttl seconds'''
+        expires = None if is_closed_range(start_date, end_date) else time.time() + self.open_range_ttl
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                    (hub, user_id, backend, start_date, end_date, json.dumps(data), expires,
+                                     time.time()))
+
+    def evict(self):
+        '''Removes expired results, then the least recently used ones until at most max_entries are left'''
+        with self.lock:
+            self.connection.execute('DELETE FROM usage WHERE expires < ?', (time.time(),))
+            self.connection.execute('DELETE FROM usage WHERE rowid IN (SELECT rowid FROM usage ORDER BY used DESC '
+                                    'LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def close(self):
+        self.evict()
+        self.connection.close()
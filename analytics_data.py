@@ -0,0 +1,138 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import csv
+from analytics_cache import parse_date
+
+'''
+Format for the entries read from analytics_data.csv:
+    {
+    user: <str>,
+    id: <str>,
+    backends: <list>,
+    start: <str>,
+    end: <str>
+    }
+start and end are both '' for all time entries.
+'''
+
+
+def parse_row(row):
+    '''Parses a row of analytics_data.csv into (user, backends, start, end), with start and end as datetime.date, or
+        both None for all time. Raises ValueError with every problem of the row'''
+    problems = []
+    if len(row) < 4:
+        raise ValueError(f"expected 4 columns (start, end, user, backends), found {len(row)}")
+
+    dates = []
+    for name, value in (('start', row[0].strip()), ('end', row[1].strip())):
+        try:
+            dates.append(parse_date(value) if value != '' else None)
+        except ValueError:
+            problems.append(f"{name} date '{value}' is not a mm-dd-yy date")
+            dates.append(None)
+    start, end = dates
+    if start is not None and end is not None and start > end:
+        problems.append(f"end date ({row[1].strip()}) cannot come before start date ({row[0].strip()})")
+    if start is None or end is None:
+        # A range missing either date is retrieved for all time
+        start = end = None
+
+    user = row[2].strip()
+    if user == '':
+        problems.append("the user is empty")
+
+    # Backends are de-duplicated, keeping the order they are listed in
+    backends = list(dict.fromkeys(backend.strip() for backend in row[3].split(',') if backend.strip() != ''))
+    if not backends:
+        problems.append("no backend is given")
+
+    if problems:
+        raise ValueError(', '.join(problems))
+
+    return user, backends, start, end
+
+
+def merge_ranges(ranges):
+    '''Merges the overlapping (start, end, start_text, end_text) date ranges of <ranges>, where start and end are
+        datetime.date and the texts are the dates as written. A merged range keeps the texts of the dates it starts
+        and ends with. Returns the merged ranges sorted by start'''
+    merged = []
+    for start, end, start_text, end_text in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end, merged[-1][2], end_text)
+        else:
+            merged.append((start, end, start_text, end_text))
+
+    return merged
+
+
+def read_analytics_data(file):
+    '''Reads and validates the whole analytics_data.csv <file> before any request is sent.
+
+        Users are compared without case and rows of the same user are combined: for each backend, the date ranges
+        that overlap are merged into one so the same analytics are never retrieved twice. Dates are kept as they are
+        written in the file, with a two or four digit year.
+
+        Returns (entries, errors, notes): the entries to retrieve, in the order of the file, one string per invalid
+        row, and one string per merge made.'''
+    errors = []
+    notes = []
+    emails = {}  # Lower case email -> email as first written
+    ranges = {}  # Lower case email -> {backend: [(start, end, start_text, end_text)]}, in the order of the file
+    all_time = {}  # Lower case email -> [backend]
+
+    reader = csv.reader(file)
+    next(reader, None)  # Skip the header
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue  # Blank lines are ignored
+        try:
+            user, backends, start, end = parse_row(row)
+        except ValueError as err:
+            errors.append(f"line {reader.line_num}: {err}")
+            continue
+
+        key = user.lower()
+        emails.setdefault(key, user)
+        for backend in backends:
+            if start is None:
+                all_time.setdefault(key, [])
+                if backend in all_time[key]:
+                    notes.append(f"line {reader.line_num}: all time analytics of {user} on {backend} are already "
+                                 f"listed, discarding the duplicate")
+                else:
+                    all_time[key].append(backend)
+            else:
+                ranges.setdefault(key, {}).setdefault(backend, []).append((start, end, row[0].strip(),
+                                                                           row[1].strip()))
+
+    # Group the backends of each user that have the same range, so each (user, range) is one entry like in the file
+    entries = []
+    for key, user in emails.items():
+        by_range = {}
+        if key in all_time:
+            by_range[('', '')] = all_time[key]
+        for backend, backend_ranges in ranges.get(key, {}).items():
+            merged = merge_ranges(backend_ranges)
+            if len(merged) < len(backend_ranges):
+                # Number of ranges that went into each merged range, to only count the ones that overlapped
+                sizes = [sum(start <= other[0] and other[1] <= end for other in backend_ranges)
+                         for start, end, _, _ in merged]
+                notes.append(f"{user} on {backend}: {sum(size for size in sizes if size > 1)} date ranges overlap and "
+                             f"were merged into {sum(size > 1 for size in sizes)}")
+            for _, _, start_text, end_text in merged:
+                by_range.setdefault((start_text, end_text), []).append(backend)
+
+        for (start, end), backends in by_range.items():
+            entries.append({'user': user, 'id': '', 'backends': backends, 'start': start, 'end': end})
+
+    return entries, errors, notes
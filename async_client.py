@@ -0,0 +1,175 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import os
+import json
+import time
+import asyncio
+import functools
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import client
+import tracing
+
+try:
+    import httpx
+except ImportError:  # Without httpx, requests are sent by the blocking client on a pool of threads
+    httpx = None
+
+try:
+    import h2  # noqa: F401  httpx can only use HTTP/2 if h2 is installed
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+# Maximum number of requests in flight to the same host
+MAX_PER_HOST = int(os.environ.get('HUB_MAX_PER_HOST', 64))
+
+
+class Response:
+    '''The parts of an httpx response the scripts use, with the same interface as a requests.Response, so callers
+        handle errors with requests.HTTPError whatever the transport'''
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content
+        self.reason = response.reason_phrase
+        self.url = str(response.url)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 500:
+            raise requests.HTTPError(f"{self.status_code} Client Error: {self.reason} for url: {self.url}",
+                                     response=self)
+        if 500 <= self.status_code < 600:
+            raise requests.HTTPError(f"{self.status_code} Server Error: {self.reason} for url: {self.url}",
+                                     response=self)
+
+
+class AsyncTransport:
+    '''Sends requests to the API from asyncio code, using the access token of auth.py.
+
+        With httpx installed, requests are sent on one pool of keep-alive connections, over HTTP/2 if h2 is
+        installed too, so hundreds of requests can be in flight from a single thread. Without httpx, the shared
+        requests session of client.py is used on a pool of <max_per_host> threads.
+
+        At most <max_per_host> requests are in flight to each host. Use it as an async context manager, or call
+        aclose() when done.'''
+
+    def __init__(self, max_per_host=MAX_PER_HOST, timeout=None):
+        self.max_per_host = max_per_host
+        connect_timeout, read_timeout = timeout or client.TIMEOUT
+        self._semaphores = {}
+        self._token = None
+        self._token_lock = None
+        if httpx is not None:
+            self._http = httpx.AsyncClient(http2=HTTP2, timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                                           limits=httpx.Limits(max_connections=None,
+                                                               max_keepalive_connections=max_per_host))
+            self._executor = None
+        else:
+            self._http = None
+            self._executor = ThreadPoolExecutor(max_workers=max_per_host)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def _semaphore(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.max_per_host)
+
+        return self._semaphores[host]
+
+    async def _authenticate(self, expired_token=None):
+        '''Returns the access token, logging in on a thread if needed. If <expired_token> is given, the API
+            rejected it and a new token is requested, unless another coroutine already replaced it.'''
+        from auth import get_access_token
+
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if self._token is None or self._token == expired_token:
+                loop = asyncio.get_running_loop()
+                self._token = await loop.run_in_executor(None, get_access_token, expired_token)
+
+            return self._token
+
+    async def _send(self, method, url, **kwargs):
+        '''Sends a request with httpx, recording its latency and response with tracing.py'''
+        start = time.perf_counter()
+        try:
+            response = Response(await self._http.request(method, url, **kwargs))
+        except BaseException:  # Also records the requests cancelled while in flight
+            tracing.record(method, url, None, time.perf_counter() - start)
+            raise
+        tracing.record(method, url, response, time.perf_counter() - start)
+
+        return response
+
+    async def request(self, method, url, authenticate=True, **kwargs):
+        '''Sends a request and returns its response. If the API answers with 401 the token has expired, so a new one
+            is requested and the request is sent again. Cancelling the calling task stops waiting for the response.'''
+        async with self._semaphore(url):
+            if self._http is None:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, functools.partial(
+                    client.request, method, url, authenticate=authenticate, **kwargs))
+
+            if not authenticate:
+                return await self._send(method, url, **kwargs)
+
+            token = await self._authenticate()
+            response = await self._send(method, url, headers={'X-Access-Token': token}, **kwargs)
+            if response.status_code == 401:
+                token = await self._authenticate(expired_token=token)
+                response = await self._send(method, url, headers={'X-Access-Token': token}, **kwargs)
+
+            return response
+
+
+async def gather(coroutines, limit=None):
+    '''Runs <coroutines> at the same time, at most <limit> at once, and returns their results in order.
+
+        If one of them raises, or the caller is cancelled, the others are cancelled and waited for before the error
+        is raised, so no request is left running in the background.'''
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def run(coroutine):
+        if semaphore is None:
+            return await coroutine
+        async with semaphore:
+            return await coroutine
+
+    tasks = [asyncio.ensure_future(run(coroutine)) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
@@ -8,14 +8,52 @@
 # copyright notice, and modified files need to carry a notice indicating
 # that they have been altered from the originals.
 
-import requests
+import os
+import time
+import hashlib
+import client
+import storage
 
 LOGIN_TOKEN = "INSERT YOUR IBM QUANTUM TOKEN"
-LOGIN_URL = 'https://auth.quantum-computing.ibm.com/api/users/loginWithToken'
+LOGIN_URL = os.environ.get('HUB_LOGIN_URL', 'https://auth.quantum-computing.ibm.com/api/users/loginWithToken')
 
+# Access tokens are cached on disk so that scripts started one after another don't each need to log in.
+# Set HUB_TOKEN_CACHE=0 to always log in.
+TOKEN_CACHE = os.environ.get('HUB_TOKEN_CACHE', '1') != '0'
+DEFAULT_TTL = 3600  # Used if the login response doesn't say how long the token is valid, in seconds
+EXPIRY_MARGIN = 300  # Stop using a cached token this many seconds before it expires
 
-def get_access_token():
-    login_response = requests.post(LOGIN_URL, data={'apiToken': LOGIN_TOKEN})
-    access_token = login_response.json()['id']
+
+def login():
+    '''Sends an API call to log in with LOGIN_TOKEN and returns the access token and the time it expires at'''
+    login_response = client.post(LOGIN_URL, data={'apiToken': LOGIN_TOKEN}, authenticate=False)
+    login_response.raise_for_status()
+    login_data = login_response.json()
+
+    return login_data['id'], time.time() + login_data.get('ttl', DEFAULT_TTL)
+
+
+def get_access_token(expired_token=None):
+    '''Returns an access token, reusing the one in the token cache while it is still valid.
+
+        If <expired_token> is given, it was rejected by the API, so a new token is requested unless
+        another process already replaced it in the cache.'''
+    if not TOKEN_CACHE:
+        return login()[0]
+
+    # Tokens are stored under a hash of the login url and token, so several accounts and servers can share the cache
+    key = hashlib.sha256(f'{LOGIN_URL} {LOGIN_TOKEN}'.encode()).hexdigest()
+    path = storage.cache_path('tokens.json')
+
+    with storage.locked(path):
+        tokens = storage.read_json(path) or {}
+        cached = tokens.get(key)
+        if cached and cached['id'] != expired_token and cached['expires'] - EXPIRY_MARGIN > time.time():
+            return cached['id']
+
+        access_token, expires = login()
+        tokens = {k: v for k, v in tokens.items() if v['expires'] > time.time()}
+        tokens[key] = {'id': access_token, 'expires': expires}
+        storage.write_json(path, tokens)
 
     return access_token
@@ -0,0 +1,184 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKLOADS = ('analytics', 'rollout', 'rollup')
+
+parser = argparse.ArgumentParser(description="Run the scripts against mock_server.py and report their wall time, "
+                                             "requests per second and peak memory. The real API is never used")
+parser.add_argument('-workloads', type=str, default='analytics,rollout',
+                    help=f"Comma separated list of the workloads to run, among {', '.join(WORKLOADS)}")
+parser.add_argument('-groups', type=int, default=50, help="Number of groups in the synthetic hub")
+parser.add_argument('-projects', type=int, default=10, help="Number of projects in each group")
+parser.add_argument('-users', type=int, default=20, help="Number of users in each project")
+parser.add_argument('-backends', type=int, default=5, help="Number of backends in the synthetic hub")
+parser.add_argument('-latency', type=float, default=0.05, help="Seconds every answer of the mock is delayed by")
+parser.add_argument('-jitter', type=float, default=0.02, help="Extra random delay of up to this many seconds")
+parser.add_argument('-error_rate', type=float, default=0.0, help="Fraction of requests answered with a 500 error")
+parser.add_argument('-rate_limit', type=float, default=0.0, help="Requests per second the mock accepts before "
+                                                                 "answering with 429. 0 for no limit")
+parser.add_argument('-workers', type=int, default=16, help="-workers given to the scripts")
+parser.add_argument('-rate', type=float, default=100.0, help="-rate given to the scripts")
+parser.add_argument('-analytics_users', type=int, default=200, help="Number of users in analytics_data.csv for the "
+                                                                    "analytics workload")
+parser.add_argument('-json', type=str, help="Also write the results to this JSON file")
+parser.add_argument('--keep', action="store_true", help="Keep the working directory with the outputs of the scripts")
+
+'''
+Every workload runs a script in a new process, in a temporary directory with its own cache directory, so no saved
+token, snapshot or analytics are reused between workloads. Peak memory is the maximum resident set size of that
+process, and requests are counted by the mock server.
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get_json(url, token=None):
+    request = urllib.request.Request(url, headers={'X-Access-Token': token} if token else {})
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+def start_mock(port):
+    '''Starts mock_server.py on <port> and waits until it answers. Returns its process'''
+    process = subprocess.Popen([sys.executable, os.path.join(SCRIPT_DIR, 'mock_server.py'), '-port', str(port),
+                                '-groups', str(args.groups), '-projects', str(args.projects), '-users', str(args.users),
+                                '-backends', str(args.backends), '-latency', str(args.latency),
+                                '-jitter', str(args.jitter), '-error_rate', str(args.error_rate),
+                                '-rate_limit', str(args.rate_limit)], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit("mock_server.py stopped before it started listening")
+        try:
+            get_json(f'http://127.0.0.1:{port}/stats')
+            return process
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    sys.exit("mock_server.py did not start listening within 60 seconds")
+
+
+def write_analytics_data(path, api_url):
+    '''Writes analytics_data.csv with -analytics_users users of the mock hub'''
+    login_request = urllib.request.Request(f'{api_url}/users/loginWithToken', data=b'apiToken=benchmark',
+                                           method='POST')
+    with urllib.request.urlopen(login_request) as response:
+        token = json.load(response)['id']
+
+    emails = []
+    for group in get_json(f'{api_url}/Network/mock-hub/users', token)['groups'].values():
+        for project in group['projects'].values():
+            emails.extend(user['email'] for user in project['users'].values())
+    emails = list(dict.fromkeys(emails))[:args.analytics_users]
+
+    backends = ','.join(f'mock_backend_{i}' for i in range(min(2, args.backends)))
+    with open(path, 'w') as file:
+        file.write('start,end,user,backends\n')
+        for email in emails:
+            file.write(f'01-01-21,12-31-21,{email},"{backends}"\n')
+
+    return len(emails)
+
+
+def workload_command(workload):
+    common = ['-workers', str(args.workers), '-rate', str(args.rate)]
+    if workload == 'analytics':
+        return ['get_analytics_for_users.py', 'mock-hub', '--no_cache'] + common
+    if workload == 'rollout':
+        return ['edit_backends_in_all_projects.py', 'mock-hub', 'add', '*', 'mock_backend_new', '-priority', '5'] + \
+            common
+    return ['get_usage_rollup.py', 'mock-hub', 'mock_backend_0', '--no_cache'] + common
+
+
+def run_workload(workload, workdir, env, stats_url):
+    '''Runs <workload> and returns its measurements'''
+    command = workload_command(workload)
+    before = get_json(stats_url)
+    with open(os.path.join(workdir, f'{workload}.log'), 'w') as log:
+        start = time.monotonic()
+        process = subprocess.Popen([sys.executable, os.path.join(SCRIPT_DIR, command[0])] + command[1:],
+                                   cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.monotonic() - start
+    after = get_json(stats_url)
+
+    def delta(key):
+        return after.get(key, 0) - before.get(key, 0)
+
+    # The mock counts every request under the name of its endpoint, and every answer under its status
+    requests = sum(delta(key) for key in after if not key.startswith('status_') and key != 'not_found')
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_memory = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+    return {'workload': workload, 'exit_code': os.waitstatus_to_exitcode(status), 'wall_time': round(elapsed, 3),
+            'requests': requests, 'requests_per_second': round(requests / max(elapsed, 0.001), 1),
+            'throttled': delta('status_429'), 'server_errors': delta('status_500'),
+            'peak_memory_mb': round(peak_memory, 1)}
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    workloads = args.workloads.replace(' ', '').split(',')
+    unknown = [workload for workload in workloads if workload not in WORKLOADS]
+    if unknown:
+        sys.exit(f"Unknown workloads: {', '.join(unknown)}. Choose among {', '.join(WORKLOADS)}")
+
+    port = free_port()
+    api_url = f'http://127.0.0.1:{port}/api'
+    workdir = tempfile.mkdtemp(prefix='hub-benchmark-')
+    env = dict(os.environ, HUB_API_URL=api_url, HUB_LOGIN_URL=f'{api_url}/users/loginWithToken',
+               HUB_CACHE_DIR=os.path.join(workdir, 'cache'))
+
+    print(f"Starting mock_server.py with {args.groups} groups of {args.projects} projects of {args.users} users")
+    mock = start_mock(port)
+    results = []
+    try:
+        if 'analytics' in workloads:
+            count = write_analytics_data(os.path.join(workdir, 'analytics_data.csv'), api_url)
+            print(f"analytics_data.csv has {count} users")
+        for workload in workloads:
+            print(f"Running {workload}...")
+            results.append(run_workload(workload, workdir, env, f'http://127.0.0.1:{port}/stats'))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    print(f"\n{'Workload':<12}{'Exit':>6}{'Wall (s)':>10}{'Requests':>10}{'Req/s':>9}{'429s':>7}{'500s':>7}"
+          f"{'Peak MB':>9}")
+    for result in results:
+        print(f"{result['workload']:<12}{result['exit_code']:>6}{result['wall_time']:>10.2f}{result['requests']:>10}"
+              f"{result['requests_per_second']:>9.1f}{result['throttled']:>7}{result['server_errors']:>7}"
+              f"{result['peak_memory_mb']:>9.1f}")
+
+    if args.json is not None:
+        with open(args.json, 'w') as file:
+            json.dump({'parameters': vars(args), 'results': results}, file, indent=4)
+
+    if args.keep:
+        print(f"\nThe outputs and logs of the scripts are in {workdir}")
+    else:
+        shutil.rmtree(workdir)
@@ -0,0 +1,91 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import os
+import json
+
+
+class Journal:
+    '''Append-only JSON lines file recording which requests of a run finished or failed.
+
+        The first line holds the <run> parameters (for example the hub) so a journal can't be resumed by a
+        different run. Every following line is {"key": [...], "status": "done", "partial" or "failed", "error": <str>}.
+        A partial key has been written to some of the outputs of the run but not all of them, and stays partial
+        until it is done. Otherwise, when a key appears more than once, the last line wins.'''
+
+    def __init__(self, path, run, resume=False):
+        self.path = path
+        self.done = set()  # Keys that finished in a previous run, only filled when resuming
+        self.failed = set()  # Keys that failed in a previous run, only filled when resuming
+        self.partial = set()  # Keys partly written by a previous run, only filled when resuming
+
+        if resume:
+            self._load(run)
+            self.file = open(path, 'a')
+        else:
+            self.file = open(path, 'w')
+            self.file.write(json.dumps(run) + '\n')
+            self.file.flush()
+
+    def _load(self, run):
+        try:
+            with open(self.path, 'r') as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            raise ValueError(f"There is no checkpoint to resume in {self.path}")
+
+        if not lines or json.loads(lines[0]) != run:
+            raise ValueError(f"The checkpoint in {self.path} was not made by this run ({json.dumps(run)})")
+
+        if len(lines) > 1 and not lines[-1].endswith('\n'):
+            # The previous run was killed while writing the last line. It is removed, otherwise the first record of
+            # this run would be appended to it and lost
+            with open(self.path, 'rb+') as file:
+                file.truncate(os.path.getsize(self.path) - len(lines[-1].encode()))
+            lines = lines[:-1]
+
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # The last line may be incomplete if the previous run was killed while writing it
+            key = tuple(record['key'])
+            if record['status'] == 'done':
+                self.done.add(key)
+                self.failed.discard(key)
+                self.partial.discard(key)
+            elif record['status'] == 'partial':
+                self.partial.add(key)
+                self.failed.discard(key)
+            else:
+                self.failed.add(key)
+                self.done.discard(key)
+
+    def is_done(self, *key):
+        return key in self.done
+
+    def is_partial(self, *key):
+        return key in self.partial
+
+    def record(self, *key, error=None, partial=False):
+        '''Records <key> as done, as partly written if <partial> is True, or as failed if an <error> is given.
+            Call flush() to write the records to disk'''
+        if partial:
+            self.file.write(json.dumps({'key': key, 'status': 'partial'}) + '\n')
+        elif error is None:
+            self.file.write(json.dumps({'key': key, 'status': 'done'}) + '\n')
+        else:
+            self.file.write(json.dumps({'key': key, 'status': 'failed', 'error': str(error)}) + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
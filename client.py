@@ -0,0 +1,119 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+import tracing
+
+# Set HUB_API_URL to send the requests to another server, such as mock_server.py
+API_URL = os.environ.get('HUB_API_URL', "https://api-qcon.quantum-computing.ibm.com/api")
+
+# Number of keep-alive connections kept open to each host. Should be at least the number of worker threads.
+POOL_SIZE = int(os.environ.get('HUB_POOL_SIZE', 32))
+
+# (connect, read) timeouts in seconds used for every request that doesn't give its own
+TIMEOUT = (float(os.environ.get('HUB_CONNECT_TIMEOUT', 10)), float(os.environ.get('HUB_READ_TIMEOUT', 120)))
+
+_session = None
+_lock = threading.Lock()
+_auth_lock = threading.Lock()
+
+
+def configure(pool_size=None, timeout=None):
+    '''Changes the connection pool size and/or the default timeout. Must be called before the first request
+        to change the pool size.'''
+    global POOL_SIZE, TIMEOUT
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    if timeout is not None:
+        TIMEOUT = timeout
+
+
+def get_session():
+    '''Returns the requests.Session shared by all the scripts, creating it on first use.
+
+        The session keeps connections alive between calls so only the first request to a host pays for the
+        TCP and TLS handshake, and it asks the API for compressed responses.'''
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update(make_headers(accept_encoding=True, keep_alive=True))
+            _session = session
+
+    return _session
+
+
+def _authenticate(session, expired_token=None):
+    '''Stores an access token on the session so every request sends it.
+
+        If <expired_token> is given, the API rejected it and a new token is requested, unless another thread
+        already replaced it.'''
+    from auth import get_access_token
+
+    if expired_token is None and 'X-Access-Token' in session.headers:
+        return
+    with _auth_lock:
+        current_token = session.headers.get('X-Access-Token')
+        if current_token is None or current_token == expired_token:
+            session.headers['X-Access-Token'] = get_access_token(expired_token)
+
+
+def _send(session, method, url, **kwargs):
+    '''Sends a request through <session>, recording its latency and response with tracing.py'''
+    start = time.perf_counter()
+    try:
+        response = session.request(method, url, **kwargs)
+    except Exception:
+        tracing.record(method, url, None, time.perf_counter() - start)
+        raise
+    tracing.record(method, url, response, time.perf_counter() - start)
+
+    return response
+
+
+def request(method, url, authenticate=True, **kwargs):
+    '''Sends a request through the shared session. Uses the default TIMEOUT unless a timeout is given.
+
+        Unless <authenticate> is False, the access token is added to the request, logging in first if needed.
+        If the API answers with 401 the token has expired, so a new one is requested and the request is sent again.'''
+    session = get_session()
+    kwargs.setdefault('timeout', TIMEOUT)
+    if not authenticate:
+        kwargs['headers'] = {**kwargs.get('headers', {}), 'X-Access-Token': None}
+        return _send(session, method, url, **kwargs)
+
+    _authenticate(session)
+    sent_token = session.headers['X-Access-Token']
+    response = _send(session, method, url, **kwargs)
+    if response.status_code == 401:
+        _authenticate(session, expired_token=sent_token)
+        response = _send(session, method, url, **kwargs)
+
+    return response
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
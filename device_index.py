@@ -0,0 +1,80 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import client
+from throttle import send
+
+
+def parse_devices(data):
+    '''Converts a list of devices returned by the API into {backend_name: priority}.
+        The priority is None if the API didn't return it.'''
+    devices = {}
+    for device in data:
+        # Depending on which API endpoint was hit- the location of the backend_name string differs
+        if 'specificConfiguration' in device:
+            devices[device['specificConfiguration']['backend_name']] = device.get('priority')
+        else:
+            devices[device['backend_name']] = device.get('priority')
+
+    return devices
+
+
+def get_devices(bucket, url):
+    '''Returns {backend_name: priority} for the devices listed at <url>, a .../devices endpoint'''
+    response = send(bucket, 'GET', url)
+    response.raise_for_status()  # Checks if the request returned an error
+
+    return parse_devices(response.json())
+
+
+def project_devices_url(hub, group, project):
+    return f'{client.API_URL}/Network/{hub}/Groups/{group}/Projects/{project}/devices'
+
+
+def iter_device_index(hub, projects, bucket, workers):
+    '''Reads the devices of all (group, project) pairs in <projects>, <workers> at a time, with the requests paced by
+        <bucket>. The hub level /devices endpoint doesn't say which project has which device, so each project is read.
+
+        Yields ((group, project), {backend_name: priority}, error) as each read finishes, where error is None if the
+        read succeeded. Only a few reads are queued ahead of the workers, so <projects> can be a lazy iterable.'''
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for key in projects:
+            pending[executor.submit(get_devices, bucket, project_devices_url(hub, *key))] = key
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from _finished(done, pending)
+        yield from _finished(wait(pending).done, pending)
+
+
+def _finished(done, pending):
+    for future in done:
+        key = pending.pop(future)
+        try:
+            yield key, future.result(), None
+        except Exception as err:
+            yield key, {}, err
+
+
+def build_device_index(hub, projects, bucket, workers):
+    '''Reads the devices of all (group, project) pairs in <projects> at the same time.
+
+        Returns ({(group, project): {backend_name: priority}}, {(group, project): error}) so a project that can't be
+        read doesn't stop the others.'''
+    index = {}
+    errors = {}
+    for key, devices, error in iter_device_index(hub, projects, bucket, workers):
+        if error is None:
+            index[key] = devices
+        else:
+            errors[key] = error
+
+    return index, errors
@@ -6,13 +6,10 @@
 # copyright notice, and modified files need to carry a notice indicating
 # that they have been altered from the originals.
 
-import requests
 import argparse
 import sys
 import json
-from auth import get_access_token
-
-API_URL = "https://api-qcon.quantum-computing.ibm.com/api"
+from hub_client import HubClient
 
 parser = argparse.ArgumentParser(description="Add or Remove a backend from a Project in the Hub")
 parser.add_argument('hub', type=str, help="The Hub to manage backends on")
@@ -30,37 +27,19 @@ project = args.project
 backend = args.backend
 priority = args.priority
 
-access_token = get_access_token()
-headers = {'X-Access-Token': access_token}
-
 # Need to check for the presence of a priority value if adding a backend
 if action == 'add':
 	if priority is None or priority not in range(1, 10001):
 		sys.exit('You must provide a priority between 1 and 10,000. Use the -h parameter for more info')
 
 # Make the API request and handle errors
-try:
-	if action == 'add':
-		if project is not None:
-			url = f'{API_URL}/Network/{hub}/Groups/{group}/Projects/{project}/devices'
-		else:
-			url = f'{API_URL}/Network/{hub}/Groups/{group}/devices'
-
-		response = requests.post(url, headers=headers, json={'name': backend, 'priority': priority})
-	else:
-		if project is not None:
-			url = f'{API_URL}/Network/{hub}/Groups/{group}/Projects/{project}/devices/{backend}'
-		else:
-			url = f'{API_URL}/Network/{hub}/Groups/{group}/devices/{backend}'
-
-		response = requests.delete(url, headers=headers)
+hub_client = HubClient(hub)
+if action == 'add':
+	result = hub_client.set_device_priority(group, backend, priority, project=project)
+else:
+	result = hub_client.remove_device(group, backend, project=project)
 
-	s = f'{hub} (group: {group} and project: {project})'
-	response.raise_for_status()
-except requests.HTTPError as http_err:
-	sys.exit(f"Could not edit backends in {s} due to HTTPError: {http_err}")
-except Exception as err:
-	sys.exit(f"Could not edit backends in {s} due to: {err}")
+if not result.ok:
+	sys.exit(f"Could not edit backends in {hub} (group: {group} and project: {project}) due to {result.error}")
 
-data = response.json()
-print(json.dumps(data, indent=4))
+print(json.dumps(result.data, indent=4))
@@ -9,88 +9,204 @@
 import requests
 import argparse
 import sys
+import json
 import time
-from auth import get_access_token
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import client
+import hub_snapshot
+from device_index import build_device_index, project_devices_url
+from throttle import TokenBucket, send
 
-API_URL = "https://api-qcon.quantum-computing.ibm.com/api"
+API_URL = client.API_URL
 
 parser = argparse.ArgumentParser(description="Add or Remove a backend from all Projects in the given Hub/Group")
 parser.add_argument('hub', type=str, help="The Hub that contains the given Group")
 parser.add_argument('action', type=str, choices=['add', 'remove'], help="Whether or not to add or remove the backend from all projects")
-parser.add_argument('group', type=str, help="Name of the group to add/remove the given backend from all Projects")
+parser.add_argument('group', type=str, help="Name of the group to add/remove the given backend from all Projects. "
+                                            "Can be a pattern such as 'research-*', or '*' for all groups in the Hub")
 parser.add_argument('backend', type=str, help="Name of the backend to be added or removed")
 parser.add_argument('-priority', type=int, help="Priority of the backend (if adding). Must be an integer between 1 and 10000")
+parser.add_argument('-project_pattern', type=str, default='*',
+                    help="Only edit the projects whose name matches this pattern, such as 'class-*'")
+parser.add_argument('-priority_map', type=str,
+                    help="JSON file mapping 'group/project' patterns to priorities, such as {\"research/*\": 100}. "
+                         "The first matching pattern gives the priority of a project. Projects that don't match use "
+                         "-priority")
+parser.add_argument('-cache_ttl', type=int, default=0,
+                    help="Seconds the saved snapshot of the hub is used before checking it with the API. Defaults "
+                         "to 0: the snapshot is always checked, and only downloaded again if the hub changed")
+parser.add_argument('--offline', action="store_true", help="Use the saved snapshot of the hub without checking it")
+parser.add_argument('-workers', type=int, default=8, help="Number of projects edited at the same time")
+parser.add_argument('-rate', type=float, default=10.0, help="Maximum number of requests per second. The rate is "
+                                                            "lowered automatically if the API asks us to slow down")
 args = parser.parse_args()
 
 hub = args.hub
 action = args.action
 group = args.group
+project_pattern = args.project_pattern
 backend = args.backend
 priority = args.priority
+priority_map_file = args.priority_map
+cache_ttl = args.cache_ttl
+offline = args.offline
+workers = args.workers
+rate = args.rate
+
+priority_map = {}
+if priority_map_file is not None:
+    with open(priority_map_file, 'r') as file:
+        priority_map = json.load(file)
+
+
+def get_priority(project_group, project):
+    '''Returns the priority of the backend in <project>: from the first matching pattern of the priority map,
+        else the -priority argument'''
+    for pattern, project_priority in priority_map.items():
+        if fnmatch.fnmatchcase(f'{project_group}/{project}', pattern):
+            return project_priority
+
+    return priority
 
-access_token = get_access_token()
-headers = {'X-Access-Token': access_token}
 
 # Need to check for the presence of a priority value if adding a backend
 if action == 'add':
-    if priority is None or priority not in range(1, 10001):
+    if (priority is None and not priority_map) or (priority is not None and priority not in range(1, 10001)):
         sys.exit('You must provide a priority between 1 and 10000. Use the -h flag for more info')
+    if any(map_priority not in range(1, 10001) for map_priority in priority_map.values()):
+        sys.exit('All priorities of the -priority_map must be integers between 1 and 10000')
 else:
-    if priority is not None:
-        print("You do not need to use the -priority arg when removing systems")
+    if priority is not None or priority_map:
+        print("You do not need to use the -priority or -priority_map args when removing systems")
+if workers < 1 or rate <= 0:
+    sys.exit("-workers and -rate must both be greater than 0")
 
 
-# Get names of Projects in Group
+# Get names of Projects in all Groups matching the group pattern. The hub is only read once, whatever the number
+# of groups
 projects_list = []
 try:
-    url = f'{API_URL}/Network/{hub}'
-    response = requests.get(url=url, headers=headers)
+    hub_data = hub_snapshot.get_hub_data(hub, max_age=cache_ttl, offline=offline)
 
-    response.raise_for_status()
-    hub_data = response.json()
-
-    if "groups" in hub_data and "projects" in hub_data["groups"][group]:
-        for project in hub_data["groups"][group]["projects"].values():
-            projects_list.append(project["name"])
+    for group_name, group_data in hub_data.get("groups", {}).items():
+        if fnmatch.fnmatchcase(group_name, group) and "projects" in group_data:
+            for project in group_data["projects"].values():
+                if fnmatch.fnmatchcase(project["name"], project_pattern):
+                    projects_list.append((group_name, project["name"]))
 except requests.HTTPError as http_err:
     sys.exit(f"Could not get hub data due to HTTPError: {http_err}")
 except Exception as err:
     sys.exit(f"Could not get hub data due to: {err}")
 
-
-# Call API to add or remove backend from all Projects found in Group
+if not projects_list:
+    sys.exit(f"No projects in {hub} match group {group} and project {project_pattern}")
 if action == 'add':
-    for project in projects_list:
+    missing = [f'{project_group}/{project}' for project_group, project in projects_list
+               if get_priority(project_group, project) is None]
+    if missing:
+        sys.exit(f"No priority is given for {', '.join(missing)}. Use -priority or add them to the -priority_map")
+
+
+# Read the devices of all the projects first, so that only the projects that need a change get a write request
+
+
+def needs_change(devices, project_priority):
+    '''Returns True if a project with <devices> ({backend_name: priority}) must be edited'''
+    if action == 'remove':
+        return backend in devices
+    # A backend is only added again if it is missing or has another priority. If the API doesn't return the
+    # priority of the project's devices, it is set again to be safe
+    return backend not in devices or devices[backend] is None or devices[backend] != project_priority
+
+
+def edit_project(project_group, project):
+    '''Adds or removes the backend in <project>. Returns what was done: added, updated or removed'''
+    url = project_devices_url(hub, project_group, project)
+    if action == 'add':
+        response = send(bucket, 'POST', url, json={'name': backend, 'priority': get_priority(project_group, project)})
+        response.raise_for_status()
+        return 'updated' if backend in device_index[(project_group, project)] else 'added'
+
+    response = send(bucket, 'DELETE', f'{url}/{backend}')
+    response.raise_for_status()
+    return 'removed'
+
+
+def show_progress(done, total, elapsed):
+    '''Draws a progress bar with the throughput on stderr, when it is a terminal'''
+    if not sys.stderr.isatty():
+        return
+    width = 30
+    filled = int(width * done / total)
+    speed = done / elapsed if elapsed > 0 else 0
+    sys.stderr.write(f"\r[{'#' * filled}{' ' * (width - filled)}] {done}/{total} projects, {speed:.1f} projects/s")
+    sys.stderr.flush()
+
+
+def clear_progress():
+    if sys.stderr.isatty():
+        sys.stderr.write("\r\033[K")
+
+
+bucket = TokenBucket(rate, burst=workers)
+results = {}
+start_time = time.monotonic()
+
+print(f"Reading the devices of {len(projects_list)} projects...")
+device_index, read_errors = build_device_index(hub, projects_list, bucket, workers)
+for key, err in read_errors.items():
+    results[key] = f"failed due to: {err}"
+    print(f"Could not read the devices of {'/'.join(key)}: {err}")
+
+to_edit = []
+for key in projects_list:
+    if key in device_index:
+        if needs_change(device_index[key], get_priority(*key)):
+            to_edit.append(key)
+        else:
+            results[key] = 'skipped'
+print(f"{len(to_edit)} projects need a change, {len(projects_list) - len(to_edit) - len(read_errors)} already match")
+
+# Projects of all groups go through the same pool and are edited in parallel. A failure in one project doesn't stop
+# the others, they are all listed at the end
+with ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = {executor.submit(edit_project, project_group, project): (project_group, project)
+               for project_group, project in to_edit}
+    for future in as_completed(futures):
+        key = futures[future]
+        name = '/'.join(key)
         try:
-            time.sleep(2)
-            url = f'{API_URL}/Network/{hub}/Groups/{group}/Projects/{project}/devices'
-            response = requests.post(url, headers=headers, json={'name': backend, 'priority': priority})
-            response.raise_for_status()
-            print(f"{backend} was added to {project}")
+            results[key] = future.result()
         except requests.HTTPError as http_err:
-            sys.exit(f"Could not add {backend} to {project} due to HTTPError: {http_err}")
+            results[key] = f"failed due to HTTPError: {http_err}"
         except Exception as err:
-            sys.exit(f"Could not add {backend} to {project} due  due to: {err}")
-    print(f"{backend} has been added to all projects in {group}")
+            results[key] = f"failed due to: {err}"
 
+        clear_progress()
+        if results[key] == 'added':
+            print(f"{backend} was added to {name}")
+        elif results[key] == 'updated':
+            print(f"{backend} priority was updated in {name}")
+        elif results[key] == 'removed':
+            print(f"{backend} was removed from {name}")
+        else:
+            print(f"Could not {action} {backend} in {name}: {results[key]}")
+        show_progress(len(results) - len(projects_list) + len(to_edit), len(to_edit), time.monotonic() - start_time)
+
+elapsed = time.monotonic() - start_time
+clear_progress()
+
+# Print a summary of what was done in each project
+print(f"\nSummary for {backend} in {hub}:")
+for key in projects_list:
+    print(f"    {'/'.join(key)}: {results[key]}")
+print(f"{len(projects_list)} projects in {elapsed:.1f}s ({len(projects_list) / max(elapsed, 0.001):.1f} projects/s)")
+
+failures = ['/'.join(key) for key, result in results.items() if result.startswith('failed')]
+if failures:
+    sys.exit(f"Could not {action} {backend} in {len(failures)} of {len(projects_list)} projects: {', '.join(failures)}")
+if action == 'add':
+    print(f"{backend} has been added to all projects in {group}")
 else:
-    for project in projects_list:
-        try:
-            time.sleep(2)
-            url = f'{API_URL}/Network/{hub}/Groups/{group}/Projects/{project}/devices'
-            response = requests.get(url, headers=headers)
-            data = response.json()
-            project_devices = [x['backend_name'] for x in data]
-            response.raise_for_status()
-            if backend not in project_devices:
-                print(f"{project} does not have access to {backend}. Skipping...")
-            else:
-                url = f'{API_URL}/Network/{hub}/Groups/{group}/Projects/{project}/devices/{backend}'
-                response = requests.delete(url, headers=headers)
-                response.raise_for_status()
-                print(f"{backend} was removed from {project}")
-        except requests.HTTPError as http_err:
-            sys.exit(f"Could not remove {backend} to {project} due  due to HTTPError: {http_err}")
-        except Exception as err:
-            sys.exit(f"Could not remove {backend} to {project} due  due to: {err}")
-    print(f"{backend} has been deleted from all projects in {group}")
\ No newline at end of file
+    print(f"{backend} has been deleted from all projects in {group}")
@@ -9,11 +9,8 @@
 # that they have been altered from the originals.
 
 import sys
-import requests
 import argparse
-from auth import get_access_token
-
-API_URL = "https://api-qcon.quantum-computing.ibm.com/api"
+from hub_client import HubClient
 
 parser = argparse.ArgumentParser(description="Add or Remove groups from your Hub")
 parser.add_argument('hub', type=str, help="Add or Remove groups from this Hub")
@@ -43,38 +40,23 @@ if action == 'add':
     else:
         group_title = args.group_title
 
-access_token = get_access_token()
-headers = {"X-Access-Token": access_token}
-
 # Send request to API based on what action was given
+hub_client = HubClient(hub)
 if action == "add":
-    try:
-        if type(group_title) != str:
-            sys.exit("Group Title must be a string")
+    if type(group_title) != str:
+        sys.exit("Group Title must be a string")
 
-        # Create Group
-        group_data = {"name": group_name, "title": group_title, "priority": priority}
-        print(f"Adding {group_name} to {hub}")
-
-        # POST request to add group
-        response = requests.post(url="{}/Network/{}/Groups".format(API_URL, hub), json=group_data, headers=headers)
-        response.raise_for_status()  # Checks if the request returned an error
-        print(f"{group_name} was successfully added to {hub}")
-    except requests.HTTPError as http_err:
-        sys.exit("Could not add group due to HTTPError: {}".format(http_err))
-    except Exception as err:
-        sys.exit("Could not add group due error: {}".format(err))
+    # Create Group
+    print(f"Adding {group_name} to {hub}")
+    result = hub_client.add_group(group_name, group_title, priority)
+    if not result.ok:
+        sys.exit("Could not add group due to {}".format(result.error))
+    print(f"{group_name} was successfully added to {hub}")
 
 else:
-    try:
-        # Delete project
-        print(f"Removing {group_name} from {hub}")
-
-        # DELETE request to remove group
-        response = requests.delete(url="{}/Network/{}/Groups/{}".format(API_URL, hub, group_name), headers=headers)
-        response.raise_for_status()  # Checks if the request returned an error
-        print(f"{group_name} was successfully removed from {hub}")
-    except requests.HTTPError as http_err:
-        sys.exit("Could not remove group due to HTTPError: {}".format(http_err))
-    except Exception as err:
-        sys.exit("Could not remove group due error: {}".format(err))
+    # Delete group
+    print(f"Removing {group_name} from {hub}")
+    result = hub_client.remove_group(group_name)
+    if not result.ok:
+        sys.exit("Could not remove group due to {}".format(result.error))
+    print(f"{group_name} was successfully removed from {hub}")
@@ -9,11 +9,8 @@
 # that they have been altered from the originals.
 
 import sys
-import requests
 import argparse
-from auth import get_access_token
-
-API_URL = "https://api-qcon.quantum-computing.ibm.com/api"
+from hub_client import HubClient
 
 parser = argparse.ArgumentParser(description="Add or Remove groups from your Hub")
 parser.add_argument('hub', type=str, help="Add or Remove groups from this Hub")
@@ -45,41 +42,26 @@ if action == 'add':
     else:
         project_title = args.project_title
 
-access_token = get_access_token()
-headers = {"X-Access-Token": access_token}
-
 # Send request to API based on what action was given
+hub_client = HubClient(hub)
 if action == "add":
-    try:
-        if type(project_title) != str:
-            sys.exit("Project Title must be a string")
-
-        # Create project
-        project_data = {"name": project_name, "title": project_title, "priority": priority}
-        print(f"Adding {project_name} to {hub}/{group}")
+    if type(project_title) != str:
+        sys.exit("Project Title must be a string")
 
-        # POST request to add project
-        response = requests.post(url="{}/Network/{}/Groups/{}/Projects".format(API_URL, hub, group),
-                                 json=project_data, headers=headers)
-        response.raise_for_status()  # Checks if the request returned an error
+    # Create project
+    print(f"Adding {project_name} to {hub}/{group}")
+    result = hub_client.add_project(group, project_name, project_title, priority)
+    if result.ok:
         print(f"{project_name} was successfully added to {hub}/{group}")
-    except requests.HTTPError as http_err:
-        print("Could not add project due to HTTPError: {}".format(http_err))
-    except Exception as err:
-        print("Could not add project due error: {}".format(err))
+    else:
+        print("Could not add project due to {}".format(result.error))
 elif action == "remove":
-    try:
-        # Delete project
-        print(f"Removing {project_name} from {hub}/{group}")
-
-        # DELETE request to remove project
-        response = requests.delete(url="{}/Network/{}/Groups/{}/Projects/{}".format(API_URL, hub, group, project_name),
-                                   headers=headers)
-        response.raise_for_status()  # Checks if the request returned an error
+    # Delete project
+    print(f"Removing {project_name} from {hub}/{group}")
+    result = hub_client.remove_project(group, project_name)
+    if result.ok:
         print(f"{project_name} was successfully removed from {hub}/{group}")
-    except requests.HTTPError as http_err:
-        print("Could not remove project due to HTTPError: {}".format(http_err))
-    except Exception as err:
-        print("Could not remove project due error: {}".format(err))
+    else:
+        print("Could not remove project due to {}".format(result.error))
 else:
     sys.exit("Please input either 'add' or 'remove' for the <action> parameter")
@@ -9,11 +9,12 @@
 # that they have been altered from the originals.
 
 import sys
+import csv
 import requests
 import argparse
-from auth import get_access_token
-
-API_URL = "https://api-qcon.quantum-computing.ibm.com/api"
+from concurrent.futures import ThreadPoolExecutor
+import user_index
+from hub_client import HubClient
 
 parser = argparse.ArgumentParser(description="Add or Remove groups from your Hub")
 parser.add_argument('hub', type=str, help="Add or Remove groups from this Hub")
@@ -21,7 +22,16 @@ parser.add_argument('group', type=str, help="Name of parent group of project")
 parser.add_argument('project', type=str, help="Name of project where user will be or is located")
 parser.add_argument('action', type=str, help="Whether you are adding or removing a user. Should be set to "
                                              "either 'add' or 'remove'")
-parser.add_argument('user_email', type=str, help="Email or user being added or removed")
+parser.add_argument('user_email', type=str, nargs='?', help="Email or user being added or removed")
+parser.add_argument('-file', type=str, help="File with one user per line to add or remove in bulk, or - to read "
+                                            "them from stdin. A line can also be 'email,group,project' to use "
+                                            "another project than <group> <project>")
+parser.add_argument('-chunk_size', type=int, default=100, help="Maximum number of users sent in one request")
+parser.add_argument('-workers', type=int, default=4, help="Number of projects edited at the same time")
+parser.add_argument('-rate', type=float, default=10.0, help="Maximum number of requests per second. The rate is "
+                                                            "lowered automatically if the API asks us to slow down")
+parser.add_argument('--no_validate', action="store_true", help="Send the request without first checking whether the "
+                                                                 "user is already in the project")
 
 args = parser.parse_args()
 
@@ -30,42 +40,126 @@ group = args.group
 project = args.project
 user = args.user_email
 action = args.action
+emails_file = args.file
+chunk_size = args.chunk_size
+workers = args.workers
+rate = args.rate
+validate = not args.no_validate
 
 if action != 'remove' and action != 'add':
     sys.exit("<action> must be set ot either 'add' or 'remove'")
+if (user is None) == (emails_file is None):
+    sys.exit("Either <user_email> or -file must be given")
+if chunk_size < 1 or workers < 1 or rate <= 0:
+    sys.exit("-chunk_size, -workers and -rate must all be greater than 0")
 
-access_token = get_access_token()
-headers = {"X-Access-Token": access_token}
+# ---------------------------------------------------------------
+# Bulk mode: add or remove all users listed in a file
 
-# Send request to API based on what action was given
-if action == "add":
+
+def read_emails(file):
+    '''Reads the users of <file> and groups them by project. Returns {(group, project): [email]}'''
+    emails = {}  # (group, project) -> {lowercase email: email as first written}
+    for row in csv.reader(file):
+        row = [cell.strip() for cell in row]
+        if not row or row[0] == '' or row[0].startswith('#'):
+            continue
+        if len(row) == 1:
+            key = (group, project)
+        elif len(row) == 3:
+            key = (row[1], row[2])
+        else:
+            sys.exit(f"Could not read line '{','.join(row)}'. Lines must be 'email' or 'email,group,project'")
+        # Emails are not case sensitive, so only the first spelling of a repeated email is kept
+        emails.setdefault(key, {}).setdefault(row[0].lower(), row[0])
+
+    return {key: list(project_emails.values()) for key, project_emails in emails.items()}
+
+
+def edit_project_users(project_group, project_name, project_emails):
+    '''Adds or removes <project_emails> in one project, sending at most chunk_size users per request.
+
+        Returns {email: error}, where error is None for the users that were successfully edited.'''
+    if action == 'add':
+        return hub_client.add_users(project_group, project_name, project_emails, chunk_size).data
+
+    return hub_client.remove_users(project_group, project_name, project_emails, chunk_size).data
+
+
+if emails_file is not None:
+    if emails_file == '-':
+        emails = read_emails(sys.stdin)
+    else:
+        with open(emails_file, 'r') as file:
+            emails = read_emails(file)
+
+    # Leave out the users that are already in (when adding) or not in (when removing) their project
+    if validate:
+        try:
+            index = user_index.get_user_index(hub, max_age=0)
+        except requests.HTTPError as http_err:
+            sys.exit("Could not validate users due to HTTPError: {}".format(http_err))
+        except Exception as err:
+            sys.exit("Could not validate users due error: {}".format(err))
+
+        for (email_group, email_project), project_emails in emails.items():
+            for email in list(project_emails):
+                if (action == "add") == index.is_member(email, email_group, email_project):
+                    print(f"{email} is {'already' if action == 'add' else 'not'} in "
+                          f"{hub}/{email_group}/{email_project}. Nothing to do")
+                    project_emails.remove(email)
+
+    # Projects are independent of each other, so they are edited in parallel
+    hub_client = HubClient(hub, rate=rate, workers=workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {key: executor.submit(edit_project_users, key[0], key[1], project_emails)
+                   for key, project_emails in emails.items() if project_emails}
+
+        failures = 0
+        for (email_group, email_project), future in futures.items():
+            for email, error in future.result().items():
+                if error is None:
+                    print(f"{email} was successfully {'added to' if action == 'add' else 'removed from'} "
+                          f"{hub}/{email_group}/{email_project}")
+                else:
+                    print(f"Could not {action} {email} in {hub}/{email_group}/{email_project} due to {error}")
+                    failures += 1
+
+    if failures:
+        sys.exit(f"Could not {action} {failures} users")
+    sys.exit()
+
+# ---------------------------------------------------------------
+# Single user mode
+
+# Check the user against the hub's user index so we don't send requests that would change nothing
+if validate:
     try:
-        # Add user
-        print(f"Adding {user} to {hub}/{group}/{project}")
-        user_data = {action: [user]}  # data must be given as a list, even if only one user is being added
-
-        # POST request to add user
-        response = requests.post(url="{}/Network/{}/Groups/{}/Projects/{}/users".format(API_URL, hub, group, project),
-                                 json=user_data, headers=headers)
-        response.raise_for_status()  # Checks if the request returned an error
-        print(f"{user} was successfully added to {hub}/{group}/{project}")
+        index = user_index.get_user_index(hub, max_age=0)
     except requests.HTTPError as http_err:
-        sys.exit("Could not add user due to HTTPError: {}".format(http_err))
+        sys.exit("Could not validate user due to HTTPError: {}".format(http_err))
     except Exception as err:
-        sys.exit("Could not add user due error: {}".format(err))
+        sys.exit("Could not validate user due error: {}".format(err))
+
+    if action == "add" and index.is_member(user, group, project):
+        print(f"{user} is already in {hub}/{group}/{project}. Nothing to do")
+        sys.exit()
+    if action == "remove" and not index.is_member(user, group, project):
+        print(f"{user} is not in {hub}/{group}/{project}. Nothing to do")
+        sys.exit()
+
+# Send request to API based on what action was given. The users endpoint takes a list, even for one user
+hub_client = HubClient(hub, rate=rate)
+if action == "add":
+    print(f"Adding {user} to {hub}/{group}/{project}")
+    result = hub_client.add_users(group, project, [user])
+    if not result.ok:
+        sys.exit(f"Could not add user due to {result.data[user]}")
+    print(f"{user} was successfully added to {hub}/{group}/{project}")
 
 else:
-    try:
-        # Remove user
-        print(f"Removing {user} from {hub}/{group}/{project}")
-        user_data = {action: [user]}  # data must be given as a list, even if only one user is being removed
-
-        # POST request to remove user
-        response = requests.post(url="{}/Network/{}/Groups/{}/Projects/{}/users".format(API_URL, hub, group, project),
-                                 json=user_data, headers=headers)
-        response.raise_for_status()  # Checks if the request returned an error
-        print(f"{user} was successfully remove from {hub}/{group}/{project}")
-    except requests.HTTPError as http_err:
-        sys.exit("Could not remove user due to HTTPError: {}".format(http_err))
-    except Exception as err:
-        sys.exit("Could not remove user due error: {}".format(err))
+    print(f"Removing {user} from {hub}/{group}/{project}")
+    result = hub_client.remove_users(group, project, [user])
+    if not result.ok:
+        sys.exit(f"Could not remove user due to {result.data[user]}")
+    print(f"{user} was successfully remove from {hub}/{group}/{project}")
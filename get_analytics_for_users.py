@@ -10,109 +10,126 @@
 
 import requests
 import csv
-import time
-import urllib
 import sys
 import warnings
 import datetime
 import argparse
-from auth import get_access_token
-
-API_URL = "https://api-qcon.quantum-computing.ibm.com/api"
-
-access_token = get_access_token()
-headers = {'X-Access-Token': access_token}
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import client
+import hub_snapshot
+import user_index
+from checkpoint import Journal
+import analytics
+from analytics import USAGE_COLUMNS, UsageDataset, system_usage_url, usage_values
+from analytics_cache import AnalyticsCache, parse_date
+from analytics_data import read_analytics_data
+from throttle import TokenBucket, send
+
+API_URL = client.API_URL
 
 parser = argparse.ArgumentParser(description="Retrieve analytics for given users on given backends over a given date "
                                              "range. Users, backends, and date ranges are pulled from "
                                              "analytics_data.csv, which must be located in the same directory")
 parser.add_argument('hub', type=str, help="The Hub analytics are retrieved for")
+parser.add_argument('-workers', type=int, default=4, help="Number of analytics requests to run at the same time")
+parser.add_argument('-rate', type=float, default=1.0, help="Maximum number of analytics requests per second. The rate "
+                                                           "is lowered automatically if the API asks us to slow down")
+parser.add_argument('-cache_ttl', type=int, default=hub_snapshot.SNAPSHOT_TTL,
+                    help="Seconds the saved snapshot of the hub users is used before checking it with the API")
+parser.add_argument('--offline', action="store_true", help="Use the saved snapshot of the hub users without checking it")
+parser.add_argument('--resume', action="store_true", help="Continue the previous run: skip the requests it finished, "
+                                                          "retry the ones that failed and append to analytics_results.csv")
+parser.add_argument('--no_cache', action="store_true", help="Always retrieve the analytics from the API instead of "
+                                                            "reusing the results saved by previous runs")
+parser.add_argument('--bucket', type=str, choices=['week', 'month'],
+                    help="Split each date range into weeks (Monday to Sunday) or calendar months and retrieve the "
+                         "analytics of each one, giving a row per week or month instead of a single total")
+parser.add_argument('-parquet', type=str,
+                    help="Also write the results to this directory as Parquet files (requires pyarrow). Every run "
+                         "adds new files, so the directory can be read as one table of all runs")
 
 args = parser.parse_args()
 
 hub = args.hub
+workers = args.workers
+rate = args.rate
+cache_ttl = args.cache_ttl
+offline = args.offline
+resume = args.resume
+use_cache = not args.no_cache
+period = args.bucket
+parquet_path = args.parquet
+
+if workers < 1 or rate <= 0:
+    sys.exit("-workers and -rate must both be greater than 0")
+if parquet_path is not None and analytics.pyarrow is None:
+    sys.exit("pyarrow must be installed to write Parquet files. Run 'pip install pyarrow'")
 
 # ---------------------------------------------------------------
 # Helper functions
 
 
-def is_date_range_valid(start_date, end_date):
-    '''Compares the start_date and end_date datettime objects to confirm that end_date is greater than start_date
-
-        Returns True is end_date is a datettime that comes after start_date. Else, returns False'''
-    start_sections = list(map(lambda x: int(x), start_date.split('-')))
-    end_sections = list(map(lambda x: int(x), end_date.split('-')))
+def split_date_range(start_date, end_date, period):
+    '''Splits the range from <start_date> to <end_date> into (start, end) windows of a <period> ('week' or 'month').
 
-    start_date = datetime.date(start_sections[2], start_sections[0], start_sections[1])
-    end_date = datetime.date(end_sections[2], end_sections[0], end_sections[1])
+        Windows follow the calendar, so the first and last ones may be shorter and the same windows come back when the
+        range is extended. The dates keep the format of <start_date>, with a two or four digit year.'''
+    date_format = '%m-%d-%y' if len(start_date.split('-')[2]) <= 2 else '%m-%d-%Y'
+    start = parse_date(start_date)
+    end = parse_date(end_date)
 
-    if start_date > end_date:
-        return False
+    windows = []
+    while start <= end:
+        if period == 'week':
+            window_end = start + datetime.timedelta(days=6 - start.weekday())
+        else:
+            next_month = (start.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+            window_end = next_month - datetime.timedelta(days=1)
+        window_end = min(window_end, end)
+        windows.append((start.strftime(date_format), window_end.strftime(date_format)))
+        start = window_end + datetime.timedelta(days=1)
 
-    return True
+    return windows
 
 
-def extract_user_ids(user_dict, data):
-    '''Extracts the user_id from <data> for all users included in <user_dict> and stores them
-        as the <id> value for the user's entry in <user_dict>'''
-    for user in data:
-        user_data = data[user]
-        email = user_data['email']
-        if email in user_dict.keys():
-            user_dict[email]['id'] = user
+def date_windows(entry):
+    '''Returns the (start, end) date ranges to retrieve for <entry>: its whole range, or one per week or month
+        with --bucket. All time entries can't be split and are retrieved as a whole.'''
+    if period is None or entry["start"] == '' or entry["end"] == '':
+        return [(entry["start"], entry["end"])]
 
-    return user_dict
+    return split_date_range(entry["start"], entry["end"], period)
 
 
 # ---------------------------------------------------------------
-# Open the analytics_data.csv file and extract the data. Data is stored in the 'users' dictionary.
+# Read and check all of analytics_data.csv before any request is sent, so every problem is reported at once
 
-'''
-Format for the <users> dictionary:
-    {
-    email: {
-        id: <str>,
-        backends: <list>, 
-        start: <str>, 
-        end: <str>
-        }
-    }
-'''
-users = {}
-
-with open("analytics_data.csv", "r") as file:
-    reader = csv.reader(file)
-    for idx, row in enumerate(reader):
-        if idx != 0:
-            start_date = row[0]
-            end_date = row[1]
-            if end_date != '' and start_date != '' and not is_date_range_valid(start_date, end_date):
-                sys.exit(f"Error: end_date ({end_date}) cannot come before start_date ({start_date})")
-            user = row[2]
-            backends = row[3].replace(' ', '').split(',')
-            if user in users:
-                warnings.warn(f"Warning: duplicate entry of {user} found. Discarding the duplicate.")
-            else:
-                users[user] = {'id': '', 'backends': backends, 'start': start_date, 'end': end_date}
-
-    file.close()
+try:
+    with open("analytics_data.csv", "r") as data_file:
+        entries, errors, notes = read_analytics_data(data_file)
+except FileNotFoundError:
+    sys.exit("analytics_data.csv was not found. It must be located in the same directory")
+
+for note in notes:
+    print(note)
+if errors:
+    for error in errors:
+        print(f"Error: {error}")
+    sys.exit(f"Found {len(errors)} errors in analytics_data.csv. No analytics were retrieved")
+if not entries:
+    sys.exit("analytics_data.csv has no users to retrieve analytics for")
 
 # ---------------------------------------------------------------
-# Retrieve user_ids for all users extracted from the data file.
-
+# Retrieve the user_ids of all users in the hub.
 
-# Send request to API to retrieve all users in hub.
-url = f'{API_URL}/Network/{hub}/users'
 
+# Send request to API to retrieve all users in hub, unless the saved snapshot is recent enough.
 try:
-    response = requests.get(url=url, headers=headers)
-    response.raise_for_status()  # Checks if the request returned an error
+    index = user_index.get_user_index(hub, max_age=cache_ttl, offline=offline)
 except requests.HTTPError as http_err:
     sys.exit(f"Could not retrieve users in {hub} due to HTTPError: {http_err}")
 except Exception as err:
-    sys.exit(f"Could not retrieve users in {hub} due to HTTPError: {err}")
-
-data = response.json()
+    sys.exit(f"Could not retrieve users in {hub} due to: {err}")
 
 '''
 Format for the returned data:
@@ -160,120 +177,174 @@ data: {
 }
 '''
 
-# Check if Hub admin are in the query data and extract and store their userIds
-extract_user_ids(users, data["users"])
-
-# Check if Group admin are in the query data and extract and store their userIds
-for group in data["groups"].values():
-    extract_user_ids(users, group["users"])
-    # Check if Project collaborators are in the query data and extract and store their userIds
-    if "projects" in group:
-        for project in group["projects"].values():
-            extract_user_ids(users, project["users"])
-
 # ---------------------------------------------------------------
-# Get analytics for each user and store in user_stats dict
-
-'''
-Format for user_stats:
-    {
-    email: {
-        backend: {
-            'averageQueueTime': <int>,
-            'averageRunTime': <int>,
-            'executions': <int>,
-            'jobs': <int>,
-            'queueTime': <int>,
-            'runTime': <int>
-            }
-        }
-    }
-'''
-user_stats = {}
+# Get analytics for each user and write them to analytics_results.csv as soon as they are returned
 
-# Parse through users dict and use data to send request to API to retrieve analytics for each user.
-for user in users:
-    start_date = users[user]["start"]
-    end_date = users[user]["end"]
-    backends = users[user]["backends"]
-    id = users[user]["id"]
 
-    # Send individual request to API for analytics for each backend included in user data
-    for backend in backends:
-        time.sleep(5)  # Prevent DDOS kickout
+def get_usage_stats(entry, backend, start_date, end_date):
+    '''Sends a request to the API to retrieve the analytics of the user in <entry> on <backend> from <start_date>
+        to <end_date>, which is the entry's date range or one of its windows'''
+    user = entry["user"]
+    id = entry["id"]
 
-        # Create options string with parameters specifying backend, user, and date range to return analytics for
-        if start_date == '' or end_date == '':
-            options = '{{"allTime": true,"backend":"{}", "userId":"{}"}}'.format(backend, id)
-        else:
-            options = '{{"startDate":"{}","endDate":"{}","backend":"{}", "userId":"{}"}}'.format(start_date, end_date,
-                                                                                                 backend, id)
+    # Reuse the results of a previous run. Results of date ranges that already ended are kept forever, so with
+    # --bucket only the windows that weren't retrieved before, or haven't ended yet, are requested again
+    if cache is not None and id != '':
+        data = cache.get(hub, id, backend, start_date, end_date)
+        if data is not None:
+            print(f"Using saved usage stats of {user} on {backend} ({start_date} - {end_date})")
+            return data
 
-        # Convert options string into url friendly format
-        options_url = urllib.parse.quote(options)
+    # Send request to API to retrieve analytics. Requests are paced by the token bucket instead of a fixed sleep.
+    url = system_usage_url(hub, id, backend, start_date, end_date)
 
-        # Send request to API to retrieve analytics
-        url = f'{API_URL}/Network/{hub}/analytics/system-usage?options={options_url}'
+    print(f"Retrieving {user}'s usage stats on {backend} ({start_date} - {end_date})...")
+    response = send(bucket, 'GET', url)
+    response.raise_for_status()  # Checks if the request returned an error
 
+    '''
+    Format for returned data:
+        data: {
+            jobs: <int>,
+            executions: <int>,
+            queueTime: <int>,
+            runTime: <int>,
+            averageRunTime: <int>,
+            averageQueueTime: <int>
+        }
+    '''
+    data = response.json()["data"]
+    if cache is not None and id != '':
+        cache.put(hub, id, backend, start_date, end_date, data)
+
+    return data
+
+
+def write_results(done):
+    '''Writes a row to analytics_results.csv for each finished request in <done> and records it in the checkpoint
+        journal. Both files are flushed, so the results are on disk even if the run stops before the end.
+        Failed requests are recorded in the journal and the run goes on.'''
+    global failures
+    for future in done:
+        entry, backend, start_date, end_date = fetches.pop(future)
+        user = entry["user"]
+        key = (user, backend, start_date, end_date)
         try:
-            print(f"Retrieving {user}'s usage stats on {backend}...")
-            response = requests.get(url=url, headers=headers)
-            response.raise_for_status()  # Checks if the request returned an error
+            usage_stats = future.result()
         except requests.HTTPError as http_err:
-            sys.exit(f"Could not retrieve analytics for {user} due to HTTPError: {http_err}")
+            print(f"Could not retrieve analytics for {user} on {backend} due to HTTPError: {http_err}")
+            journal.record(*key, error=http_err)
+            failures += 1
+            continue
         except Exception as err:
-            sys.exit(f"Could not retrieve analytics for {user} due error: {err}")
-
-        '''
-        Format for returned data:
-            data: {
-                jobs: <int>,
-                executions: <int>,
-                queueTime: <int>,
-                runTime: <int>,
-                averageRunTime: <int>,
-                averageQueueTime: <int>
-            }
-        '''
-        data = response.json()
+            print(f"Could not retrieve analytics for {user} on {backend} due error: {err}")
+            journal.record(*key, error=err)
+            failures += 1
+            continue
 
-        # Store returned data in user_stats dict
-        current_data = user_stats.get(user, {})
-        current_data[backend] = data["data"]
-        user_stats[user] = current_data
+        # With -parquet, a resumed run may already have the CSV row of a request whose Parquet row was lost
+        in_csv = journal.is_partial(*key)
+        print(f"Writing analytics for {user} on {backend}")
 
+        # Write values for each data field to the user's row, in the order of the header whatever the order the
+        # API returns them in
+        next_row = [user, backend] + ['' if value is None else value for value in usage_values(usage_stats)]
 
-# ---------------------------------------------------------------
-# Create new .csv file and write results to file
+        # Write date range to row or all time
+        if start_date == '' or end_date == '':
+            next_row.append("All Time")
+        else:
+            next_row.append(f"{start_date} - {end_date}")
+        if not in_csv:
+            writer.writerow(next_row)
+
+        # With -parquet, a request is only recorded as done once its row is in a Parquet file. Until then it is
+        # recorded as partial, so a resumed run only writes its Parquet row
+        if dataset is None:
+            journal.record(*key)
+        else:
+            if not in_csv:
+                journal.record(*key, partial=True)
+            for written_key in dataset.write(hub, user, backend, start_date, end_date, usage_stats, key):
+                journal.record(*written_key)
+
+    # The results are flushed before the journal, so a request is never marked done without its row on disk
+    results_file.flush()
+    journal.flush()
 
 
-with open("analytics_results.csv", "w") as file:
-    writer = csv.writer(file)
+# Every finished request is recorded in the checkpoint journal so that a failed or interrupted run can be resumed
+# A run split into windows can only be resumed with the same --bucket
+run = {'hub': hub} if period is None else {'hub': hub, 'bucket': period}
+try:
+    journal = Journal("analytics_checkpoint.jsonl", run, resume=resume)
+except ValueError as err:
+    sys.exit(f"Could not resume the previous run: {err}")
+if resume:
+    print(f"Resuming the previous run: {len(journal.done)} requests are done, {len(journal.failed)} will be retried")
+    if journal.partial:
+        print(f"{len(journal.partial)} requests are in analytics_results.csv but not in the Parquet files yet")
+    if journal.partial and parquet_path is None:
+        sys.exit(f"{len(journal.partial)} requests of the previous run are missing from its Parquet files. Resume "
+                 f"it with -parquet")
+
+cache = AnalyticsCache() if use_cache else None
+dataset = UsageDataset(parquet_path) if parquet_path is not None else None
+bucket = TokenBucket(rate, burst=workers)
+executor = ThreadPoolExecutor(max_workers=workers)
+
+# Requests that have been sent but not written yet, mapped to their (entry, backend, start, end). Only a few requests are
+# queued ahead of the workers, so memory use doesn't grow with the size of analytics_data.csv
+fetches = {}
+max_pending = workers * 2
+failures = 0
+
+with open("analytics_results.csv", "a" if resume else "w") as results_file:
+    writer = csv.writer(results_file)
 
     # Write header cells for all returned data
-    writer.writerow(["User", "Backend", "Jobs", "Executions", "Queue Time (ms)", "Run Time (ms)",
-                     "Average Run Time (ms)", "Average Queue Time (ms)", "Date Range"])
-
-    print(f"Starting to write analytics to {file.name}")
-
-    # Parse through users in user_stats dict
-    for user, stats_dict in user_stats.items():
-        # Parse through backends for user
-        for backend, usage_stats in stats_dict.items():
-            print(f"Writing analytics for {user} on {backend}")
-
-            # Write values for each data field to the user's row
-            next_row = [user, backend]
-            for stat in usage_stats.values():
-                next_row.append(stat)
-
-            # Write date range to row or all time
-            if users[user]["start"] == '' or users[user]["end"] == '':
-                next_row.append("All Time")
-            else:
-                next_row.append(f"{users[user]['start']} - {users[user]['end']}")
-            writer.writerow(next_row)
+    if not resume:
+        writer.writerow(["User", "Backend"] + [header for _, header, _ in USAGE_COLUMNS] + ["Date Range"])
 
-    file.close()
+    print(f"Starting to write analytics to {results_file.name}")
+
+    for entry in entries:
+        # Look up the userId of the user in the index of hub admins, group admins and project collaborators
+        id = index.user_id(entry["user"])
+        if id is None:
+            warnings.warn(f"Warning: {entry['user']} was not found in {hub}")
+        else:
+            entry["id"] = id
+
+        if period is not None and (entry["start"] == '' or entry["end"] == ''):
+            warnings.warn(f"Warning: {entry['user']} has no date range to split by {period}. Retrieving all time "
+                          f"analytics instead.")
+
+        # Send individual request to API for analytics for each backend included in user data and each window of
+        # the date range, skipping the ones a previous run already retrieved
+        for backend in entry["backends"]:
+            for start_date, end_date in date_windows(entry):
+                if journal.is_done(entry["user"], backend, start_date, end_date):
+                    continue
+                fetches[executor.submit(get_usage_stats, entry, backend, start_date, end_date)] = \
+                    (entry, backend, start_date, end_date)
+                if len(fetches) >= max_pending:
+                    done, _ = wait(fetches, return_when=FIRST_COMPLETED)
+                    write_results(done)
+
+    write_results(wait(fetches).done)
+
+    if dataset is not None:
+        for written_key in dataset.close():
+            journal.record(*written_key)
+
+executor.shutdown()
+journal.close()
+if cache is not None:
+    cache.close()
+
+if failures:
+    sys.exit(f"Could not retrieve {failures} of the analytics. The other results are in analytics_results.csv. "
+             f"Run again with --resume to retry the failed requests")
 
 print("Finished retrieving analytics. You can view the results in analytics_results.csv")
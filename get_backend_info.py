@@ -9,16 +9,45 @@
 import requests
 import argparse
 import sys
+import csv
 import json
-from auth import get_access_token
+import time
+import hashlib
+import client
+import hub_snapshot
+from device_index import iter_device_index
+from throttle import TokenBucket, send
 
-API_URL = "https://api-qcon.quantum-computing.ibm.com/api"
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Matrices can only be written as Parquet if pyarrow is installed
+    pyarrow = None
+
+try:
+    import orjson
+except ImportError:  # The standard json module is used if orjson isn't installed
+    orjson = None
+
+API_URL = client.API_URL
 
 parser = argparse.ArgumentParser(description="Retrieve backend system information from your entire Hub or a specific Project")
 parser.add_argument('hub', type=str, help="The Hub to retreive backend information from")
 parser.add_argument('-group', type=str, help="Name of the group to retrieve backends from")
 parser.add_argument('-project', type=str, help="Name of the project to retrieve backends from")
 parser.add_argument('--full_data', action="store_true", help="Print out the full JSON response for all backend data")
+parser.add_argument('--fields', type=str,
+                    help="Comma separated list of fields to print for each backend, such as "
+                         "backend_name,n_qubits,basis_gates. Prints one JSON object per line. Use dots for nested "
+                         "fields, such as specificConfiguration.online_date")
+parser.add_argument('-watch', type=int, help="Only print the backends that were added, removed or changed since the "
+                                             "last check, then check again every this many seconds. Use 0 to check "
+                                             "only once, for example from a scheduled job")
+parser.add_argument('-matrix', type=str, help="Write a table of which project has which backend, with its priority, to "
+                                              "this .csv or .parquet file. Covers every project of the Hub, or of "
+                                              "-group if given")
+parser.add_argument('-workers', type=int, default=8, help="Number of projects read at the same time with -matrix")
+parser.add_argument('-rate', type=float, default=10.0, help="Maximum number of requests per second with -matrix")
 
 args = parser.parse_args()
 
@@ -26,31 +55,259 @@ hub = args.hub
 group = args.group
 project = args.project
 full_data = args.full_data
+fields = args.fields.split(',') if args.fields else None
+matrix_file = args.matrix
+watch = args.watch
+workers = args.workers
+rate = args.rate
+
+# ---------------------------------------------------------------
+# Matrix mode: write a project x backend table of priorities
+
+
+class MatrixWriter:
+    '''Writes the rows of the matrix to a CSV file, or to a Parquet file if <path> ends in .parquet.
+
+        Parquet rows are written in batches of BATCH_SIZE, so only one batch is ever held in memory.'''
+    BATCH_SIZE = 1000
+
+    def __init__(self, path, backends):
+        self.backends = backends
+        self.parquet = path.endswith('.parquet')
+        if self.parquet:
+            if pyarrow is None:
+                sys.exit("pyarrow must be installed to write Parquet files. Use a .csv file or run "
+                         "'pip install pyarrow'")
+            fields = [pyarrow.field('group', pyarrow.string()), pyarrow.field('project', pyarrow.string())]
+            fields += [pyarrow.field(backend, pyarrow.int32()) for backend in backends]
+            self.schema = pyarrow.schema(fields)
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+            self.batch = []
+        else:
+            self.file = open(path, 'w', newline='')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(['Group', 'Project'] + backends)
+
+    def write(self, group_name, project_name, devices):
+        '''Writes the row of a project. A backend's cell is its priority, 0 if the API didn't return the priority,
+            or empty if the project doesn't have the backend'''
+        cells = [None if backend not in devices else devices[backend] or 0 for backend in self.backends]
+        if self.parquet:
+            self.batch.append([group_name, project_name] + cells)
+            if len(self.batch) >= self.BATCH_SIZE:
+                self.flush()
+        else:
+            self.writer.writerow([group_name, project_name] + ['' if cell is None else cell for cell in cells])
+
+    def flush(self):
+        if self.parquet:
+            if self.batch:
+                columns = list(zip(*self.batch))
+                self.writer.write_table(pyarrow.Table.from_arrays(
+                    [pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+                    schema=self.schema))
+                self.batch = []
+        else:
+            self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.parquet:
+            self.writer.close()
+        else:
+            self.file.close()
+
+
+def iter_projects(hub_data):
+    '''Yields the (group, project) pairs of the hub, or of -group if given'''
+    for group_name, group_data in hub_data.get("groups", {}).items():
+        if group is not None and group_name != group:
+            continue
+        for project_name, project_data in group_data.get("projects", {}).items():
+            if (project is None or project_name == project) and not project_data.get("deleted", False):
+                yield group_name, project_name
+
+
+if matrix_file is not None:
+    if workers < 1 or rate <= 0:
+        sys.exit("-workers and -rate must both be greater than 0")
+    bucket = TokenBucket(rate, burst=workers)
+    try:
+        # The columns are the backends of the whole hub, so rows can be written as soon as each project is read
+        response = send(bucket, 'GET', f'{API_URL}/Network/{hub}/devices')
+        response.raise_for_status()  # Checks if the request returned an error
+        hub_backends = [obj['specificConfiguration']['backend_name'] if 'specificConfiguration' in obj
+                        else obj['backend_name'] for obj in response.json()]
+        # The matrix is a report of the current state, so the snapshot is always checked with the API, which
+        # only sends the data again if it changed
+        hub_data = hub_snapshot.get_hub_data(hub, max_age=0)
+    except requests.HTTPError as http_err:
+        sys.exit(f"Could not retrieve backend information in {hub} due to HTTPError: {http_err}")
+    except Exception as err:
+        sys.exit(f"Could not retrieve backend information in {hub} due to: {err}")
+
+    writer = MatrixWriter(matrix_file, hub_backends)
+    failures = 0
+    rows = 0
+    for (group_name, project_name), devices, error in iter_device_index(hub, iter_projects(hub_data), bucket,
+                                                                        workers):
+        if error is not None:
+            print(f"Could not retrieve backend information in {group_name}/{project_name} due to: {error}")
+            failures += 1
+            continue
+        for backend in devices:
+            if backend not in hub_backends:
+                print(f"{group_name}/{project_name} has {backend}, which is not a backend of {hub}. Leaving it out")
+        writer.write(group_name, project_name, devices)
+        rows += 1
+    writer.close()
+
+    print(f"Wrote the backends of {rows} projects to {matrix_file}")
+    if failures:
+        sys.exit(f"Could not retrieve the backends of {failures} projects")
+    sys.exit()
+
+# ---------------------------------------------------------------
+# Field selection for --fields
+
+
+def get_field(obj, path):
+    '''Returns the field at the dotted <path> in the backend <obj>, or None if it is missing. Fields that are not at
+        the top level are also looked up in specificConfiguration, where the hub level endpoint puts them'''
+    for root in (obj, obj.get('specificConfiguration') or {}):
+        value = root
+        for key in path.split('.'):
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            return value
 
-access_token = get_access_token()
-headers = {'X-Access-Token': access_token}
+    return None
 
+
+# ---------------------------------------------------------------
 # Determine which URL to use- either it is a request for the entire Hub's devices or a specific project's devices.
 # The group and project arguments are mutually inclusive so validate that.
 if group is None and project is None:
-	url = f'{API_URL}/Network/{hub}/devices'
+	endpoint = '/devices'
 	s = hub
 elif group is not None and project is not None:
-	url = f'{API_URL}/Network/{hub}/Groups/{group}/Projects/{project}/devices'
+	endpoint = f'/Groups/{group}/Projects/{project}/devices'
 	s = f'{hub} (group: {group} and project: {project})'
 else:
 	sys.exit("You must provide both -group and -project arguments, use the -h parameter for more information")
+url = f'{API_URL}/Network/{hub}{endpoint}'
+
+# ---------------------------------------------------------------
+# Watch mode: only report what changed since the previous check
+
+
+def backend_name(obj):
+    # Depending on which API endpoint was hit- the location of the backend_name string differs
+    if 'specificConfiguration' in obj:
+        return obj['specificConfiguration']['backend_name']
+    return obj['backend_name']
+
+
+def hash_backends(data):
+    '''Returns {backend_name: hash of its data}, so changed backends are found without comparing their whole data'''
+    return {backend_name(obj): hashlib.sha256(json.dumps(obj, sort_keys=True).encode()).hexdigest() for obj in data}
+
+
+def flatten(value, prefix=''):
+    '''Returns {dotted path: value} for all the fields of the nested dict <value>'''
+    if not isinstance(value, dict):
+        return {prefix: value}
+    fields = {}
+    for key, child in value.items():
+        fields.update(flatten(child, f'{prefix}.{key}' if prefix else key))
+
+    return fields
+
+
+def report_changes(old_data, new_data):
+    '''Prints the backends that were added or removed and the fields that changed between two responses.
+        Returns the number of changes.'''
+    old_hashes = hash_backends(old_data)
+    new_hashes = hash_backends(new_data)
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    changes = 0
+
+    for name in new_hashes.keys() - old_hashes.keys():
+        print(f"{now} added: {name}")
+        changes += 1
+    for name in old_hashes.keys() - new_hashes.keys():
+        print(f"{now} removed: {name}")
+        changes += 1
+
+    changed = {name for name in new_hashes.keys() & old_hashes.keys() if new_hashes[name] != old_hashes[name]}
+    if changed:
+        old_fields = {backend_name(obj): flatten(obj) for obj in old_data if backend_name(obj) in changed}
+        new_fields = {backend_name(obj): flatten(obj) for obj in new_data if backend_name(obj) in changed}
+        for name in sorted(changed):
+            for field in sorted(old_fields[name].keys() | new_fields[name].keys()):
+                old_value = old_fields[name].get(field)
+                new_value = new_fields[name].get(field)
+                if old_value != new_value:
+                    print(f"{now} changed: {name} {field}: {json.dumps(old_value)} -> {json.dumps(new_value)}")
+                    changes += 1
+
+    sys.stdout.flush()
+    return changes
+
+
+if watch is not None:
+    # The previous response is kept on disk by hub_snapshot, which also sends the checks as conditional requests,
+    # so an unchanged list of backends isn't downloaded again if the API supports it
+    try:
+        previous = hub_snapshot.get_snapshot(hub, endpoint, offline=True)['data']
+    except hub_snapshot.OfflineError:
+        previous = None
+
+    while True:
+        try:
+            current = hub_snapshot.get_snapshot(hub, endpoint, max_age=0)['data']
+        except requests.HTTPError as http_err:
+            print(f"Could not retrieve backend information in {s} due to HTTPError: {http_err}")
+            current = previous
+        except Exception as err:
+            print(f"Could not retrieve backend information in {s} due to: {err}")
+            current = previous
+
+        if previous is None and current is not None:
+            print(f"Saved the {len(current)} backends of {s}. Changes will be reported from the next check")
+        elif current is not None:
+            report_changes(previous, current)
+        previous = current
+
+        if watch <= 0:
+            break
+        time.sleep(watch)
+    sys.exit()
 
 # Make the API request and handle errors
 try:
-    response = requests.get(url=url, headers=headers)
+    response = client.get(url=url)
     response.raise_for_status()  # Checks if the request returned an error
 except requests.HTTPError as http_err:
     sys.exit(f"Could not retrieve backend information in {s} due to HTTPError: {http_err}")
 except Exception as err:
     sys.exit(f"Could not retrieve backend information in {s} due to: {err}")
 
-data = response.json()
+data = orjson.loads(response.content) if orjson is not None else response.json()
+
+# Print only the selected fields of each backend, one JSON object per line, so the output can be piped to other tools
+if fields:
+    for obj in data:
+        line = {field: get_field(obj, field) for field in fields}
+        if orjson is not None:
+            sys.stdout.buffer.write(orjson.dumps(line) + b'\n')
+        else:
+            sys.stdout.write(json.dumps(line) + '\n')
+    sys.stdout.flush()
+    sys.exit()
+
 if full_data:
 	print(json.dumps(data, indent=4, sort_keys=True))
 
@@ -0,0 +1,174 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import requests
+import csv
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import hub_snapshot
+import user_index
+from analytics import TOTAL_FIELDS, get_system_usage, add_totals
+from analytics_cache import AnalyticsCache, parse_date
+from throttle import TokenBucket
+
+parser = argparse.ArgumentParser(description="Retrieve the usage of every project collaborator of a Hub and add it up "
+                                             "by project, group and Hub. The results are written to "
+                                             "usage_rollup.csv")
+parser.add_argument('hub', type=str, help="The Hub to retrieve the usage of")
+parser.add_argument('backends', type=str, help="Comma separated list of the backends to retrieve the usage on")
+parser.add_argument('-start', type=str, default='', help="Start of the date range, as mm-dd-yy. Uses all time if "
+                                                         "-start or -end is not given")
+parser.add_argument('-end', type=str, default='', help="End of the date range, as mm-dd-yy")
+parser.add_argument('-group', type=str, help="Only retrieve the usage of the members of this group")
+parser.add_argument('-workers', type=int, default=4, help="Number of analytics requests to run at the same time")
+parser.add_argument('-rate', type=float, default=1.0, help="Maximum number of analytics requests per second. The rate "
+                                                           "is lowered automatically if the API asks us to slow down")
+parser.add_argument('-cache_ttl', type=int, default=hub_snapshot.SNAPSHOT_TTL,
+                    help="Seconds the saved snapshot of the hub users is used before checking it with the API")
+parser.add_argument('--offline', action="store_true",
+                    help="Use the saved snapshot of the hub users without checking it")
+parser.add_argument('--no_cache', action="store_true", help="Always retrieve the analytics from the API instead of "
+                                                            "reusing the results saved by previous runs")
+
+args = parser.parse_args()
+
+hub = args.hub
+backends = list(dict.fromkeys(args.backends.replace(' ', '').split(',')))
+start_date = args.start
+end_date = args.end
+only_group = args.group
+workers = args.workers
+rate = args.rate
+cache_ttl = args.cache_ttl
+offline = args.offline
+use_cache = not args.no_cache
+
+if workers < 1 or rate <= 0:
+    sys.exit("-workers and -rate must both be greater than 0")
+if start_date != '' and end_date != '':
+    try:
+        if parse_date(start_date) > parse_date(end_date):
+            sys.exit(f"Error: end_date ({end_date}) cannot come before start_date ({start_date})")
+    except ValueError as err:
+        sys.exit(f"Error: the dates must be given as mm-dd-yy: {err}")
+
+# ---------------------------------------------------------------
+# Find the projects of every user from the hub users, which are read once
+
+
+try:
+    index = user_index.get_user_index(hub, max_age=cache_ttl, offline=offline)
+except requests.HTTPError as http_err:
+    sys.exit(f"Could not retrieve users in {hub} due to HTTPError: {http_err}")
+except Exception as err:
+    sys.exit(f"Could not retrieve users in {hub} due to: {err}")
+
+# {userId: {(group, project)}}. A user who belongs to several projects is only in here once, so their usage is
+# only retrieved once
+members = {}
+for email in index.memberships:
+    projects = {key for key in index.projects_of(email) if only_group is None or key[0] == only_group}
+    if projects:
+        members[index.user_id(email)] = projects
+
+if not members:
+    sys.exit(f"No project collaborators were found in {only_group or hub}")
+
+# ---------------------------------------------------------------
+# Retrieve the usage of every member on every backend at the same time
+
+
+def get_member_totals(user_id):
+    '''Returns the TOTAL_FIELDS of <user_id> added up over all backends'''
+    totals = [0] * len(TOTAL_FIELDS)
+    for backend in backends:
+        add_totals(totals, get_system_usage(bucket, hub, user_id, backend, start_date, end_date, cache))
+
+    return totals
+
+
+cache = AnalyticsCache() if use_cache else None
+bucket = TokenBucket(rate, burst=workers)
+member_totals = {}
+failures = {}
+
+print(f"Retrieving the usage of {len(members)} users on {', '.join(backends)}...")
+with ThreadPoolExecutor(max_workers=workers) as executor:
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            user_id = pending.pop(future)
+            try:
+                member_totals[user_id] = future.result()
+            except requests.HTTPError as http_err:
+                failures[user_id] = f"HTTPError: {http_err}"
+            except Exception as err:
+                failures[user_id] = f"error: {err}"
+        print(f"{len(member_totals) + len(failures)}/{len(members)} users retrieved")
+
+    for user_id in members:
+        pending[executor.submit(get_member_totals, user_id)] = user_id
+        if len(pending) >= workers * 2:
+            collect(wait(pending, return_when=FIRST_COMPLETED).done)
+    collect(wait(pending).done)
+
+if cache is not None:
+    cache.close()
+
+# ---------------------------------------------------------------
+# Add up the usage by project, group and hub. A user counts once in each group and in the hub, even if they belong
+# to several of its projects
+
+
+def add_up(user_ids):
+    totals = [0] * len(TOTAL_FIELDS)
+    for user_id in user_ids:
+        if user_id in member_totals:
+            totals = [total + value for total, value in zip(totals, member_totals[user_id])]
+
+    return totals
+
+
+project_users = {}
+for user_id, projects in members.items():
+    for group_name, project_name in projects:
+        project_users.setdefault(group_name, {}).setdefault(project_name, set()).add(user_id)
+
+rows = [('hub', '', '', len(members), add_up(members))]
+for group_name in sorted(project_users):
+    group_users = set().union(*project_users[group_name].values())
+    rows.append(('group', group_name, '', len(group_users), add_up(group_users)))
+    for project_name in sorted(project_users[group_name]):
+        users = project_users[group_name][project_name]
+        rows.append(('project', group_name, project_name, len(users), add_up(users)))
+
+with open("usage_rollup.csv", "w") as results_file:
+    writer = csv.writer(results_file)
+    writer.writerow(["Level", "Group", "Project", "Users", "Jobs", "Executions", "Queue Time (ms)", "Run Time (ms)",
+                     "Date Range"])
+    for level, group_name, project_name, users, totals in rows:
+        writer.writerow([level, group_name, project_name, users] + totals +
+                        ["All Time" if start_date == '' or end_date == '' else f"{start_date} - {end_date}"])
+
+# Print the hierarchy
+for level, group_name, project_name, users, totals in rows:
+    name = {'hub': hub, 'group': group_name, 'project': f'{group_name}/{project_name}'}[level]
+    indent = {'hub': '', 'group': '    ', 'project': '        '}[level]
+    stats = ", ".join(f"{field} {value}" for field, value in zip(TOTAL_FIELDS, totals))
+    print(f"{indent}{name}: {users} users, {stats}")
+
+if failures:
+    for user_id, error in failures.items():
+        print(f"Could not retrieve the usage of {user_id} due to {error}")
+    sys.exit(f"The usage of {len(failures)} of {len(members)} users is missing from the totals in usage_rollup.csv")
+
+print("Finished retrieving usage. You can view the results in usage_rollup.csv")
@@ -0,0 +1,295 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import asyncio
+import requests
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import client
+import hub_snapshot
+import user_index
+import async_client
+from analytics import get_system_usage, system_usage_url
+from device_index import parse_devices
+from throttle import TokenBucket, send, send_async
+
+# Outcome of an operation. <target> names what was changed, such as 'group/project'. <status> is the HTTP status code
+# of the last request sent, or None if it isn't known. <data> is the JSON answer of the API, or what the
+# operation returns. <error> describes why the operation failed, and is None if <ok> is True.
+Result = namedtuple('Result', ['operation', 'target', 'ok', 'status', 'data', 'error'])
+
+
+class HubClient:
+    '''Operations on the groups, projects, users and backends of a <hub> that can be called from Python.
+
+        Operations never exit or raise for a failed request, they return a Result instead. All the operations of
+        a HubClient share the same connection pool and are paced by the same token bucket, which sends at most
+        <rate> requests per second. batch() and submit() run operations on <workers> threads at the same time.
+
+        Example:
+            with HubClient('my-hub') as hub_client:
+                result = hub_client.add_group('research', 'Research')
+                results = hub_client.batch(('remove_project', 'research', name) for name in projects)'''
+
+    def __init__(self, hub, rate=10.0, workers=8, bucket=None, cache=None):
+        self.hub = hub
+        self.workers = workers
+        self.bucket = bucket or TokenBucket(rate, burst=workers)
+        self.cache = cache  # Optional AnalyticsCache used by usage()
+        self.url = f'{client.API_URL}/Network/{hub}'
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''Waits for the operations submitted to the worker threads to finish and stops the threads'''
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _send(self, operation, target, method, url, changes_hub=False, **kwargs):
+        '''Sends a request and returns its Result. If <changes_hub> is True the request creates or deletes groups,
+            projects or users, so the snapshots of the hub are dropped once it succeeds'''
+        try:
+            response = send(self.bucket, method, url, **kwargs)
+            response.raise_for_status()  # Checks if the request returned an error
+        except requests.HTTPError as http_err:
+            return Result(operation, target, False, http_err.response.status_code, None, f"HTTPError: {http_err}")
+        except Exception as err:
+            return Result(operation, target, False, None, None, f"error: {err}")
+        if changes_hub:
+            hub_snapshot.invalidate(self.hub)
+
+        try:
+            data = response.json()
+        except ValueError:
+            data = None  # Some endpoints answer with an empty body
+
+        return Result(operation, target, True, response.status_code, data, None)
+
+    def _devices_url(self, group, project=None):
+        if project is None:
+            return f'{self.url}/Groups/{group}/devices'
+        return f'{self.url}/Groups/{group}/Projects/{project}/devices'
+
+    # ---------------------------------------------------------------
+    # Groups and projects
+
+    def add_group(self, name, title, share=None):
+        return self._send('add_group', name, 'POST', f'{self.url}/Groups', changes_hub=True,
+                          json={"name": name, "title": title, "priority": share})
+
+    def remove_group(self, name):
+        return self._send('remove_group', name, 'DELETE', f'{self.url}/Groups/{name}', changes_hub=True)
+
+    def add_project(self, group, name, title, share=None):
+        return self._send('add_project', f'{group}/{name}', 'POST', f'{self.url}/Groups/{group}/Projects',
+                          changes_hub=True, json={"name": name, "title": title, "priority": share})
+
+    def remove_project(self, group, name):
+        return self._send('remove_project', f'{group}/{name}', 'DELETE', f'{self.url}/Groups/{group}/Projects/{name}',
+                          changes_hub=True)
+
+    # ---------------------------------------------------------------
+    # Backends
+
+    def get_devices(self, group, project=None):
+        '''Returns a Result whose data is {backend_name: priority} for the backends of <group>, or of <project>'''
+        target = group if project is None else f'{group}/{project}'
+        result = self._send('get_devices', target, 'GET', self._devices_url(group, project))
+        if result.ok:
+            result = result._replace(data=parse_devices(result.data))
+
+        return result
+
+    def set_device_priority(self, group, backend, priority, project=None):
+        '''Adds <backend> to <group>, or to <project>, with <priority>, or changes its priority if it is already
+            there. <priority> must be an integer between 1 and 10000, otherwise no request is sent'''
+        target = group if project is None else f'{group}/{project}'
+        if priority not in range(1, 10001):
+            return Result('set_device_priority', f'{target}/{backend}', False, None, None,
+                          f"The priority of a backend must be an integer between 1 and 10000, not {priority}")
+        return self._send('set_device_priority', f'{target}/{backend}', 'POST', self._devices_url(group, project),
+                          json={'name': backend, 'priority': priority})
+
+    def remove_device(self, group, backend, project=None):
+        target = group if project is None else f'{group}/{project}'
+        return self._send('remove_device', f'{target}/{backend}', 'DELETE',
+                          f'{self._devices_url(group, project)}/{backend}')
+
+    # ---------------------------------------------------------------
+    # Users
+
+    def add_users(self, group, project, emails, chunk_size=100):
+        '''Adds <emails> to <project>, sending at most <chunk_size> users per request. The data of the Result is
+            {email: error}, where error is None for the users that were added'''
+        return self._edit_users('add', group, project, emails, chunk_size)
+
+    def remove_users(self, group, project, emails, chunk_size=100):
+        '''Removes <emails> from <project>, like add_users()'''
+        return self._edit_users('remove', group, project, emails, chunk_size)
+
+    def _edit_users(self, action, group, project, emails, chunk_size):
+        url = f'{self.url}/Groups/{group}/Projects/{project}/users'
+        errors = {}
+        status = None
+        for i in range(0, len(emails), chunk_size):
+            chunk = emails[i:i + chunk_size]
+            result = self._send(f'{action}_users', f'{group}/{project}', 'POST', url, changes_hub=True,
+                                json={action: chunk})
+            status = result.status
+            errors.update((email, result.error) for email in chunk)
+
+        failures = sum(error is not None for error in errors.values())
+        return Result(f'{action}_users', f'{group}/{project}', not failures, status, errors,
+                      f"{failures} of {len(emails)} users could not be edited" if failures else None)
+
+    def user_id(self, email, max_age=hub_snapshot.SNAPSHOT_TTL):
+        '''Returns the userId of <email>, or None if the user isn't in the hub'''
+        return user_index.get_user_index(self.hub, max_age=max_age).user_id(email)
+
+    # ---------------------------------------------------------------
+    # Analytics
+
+    def usage(self, user, backend, start_date='', end_date=''):
+        '''Returns a Result whose data is the analytics of <user> (an email or a userId) on <backend> from
+            <start_date> to <end_date> (mm-dd-yy), or of all time if they are not given'''
+        try:
+            user_id = self.user_id(user) if '@' in user else user
+            if user_id is None:
+                return Result('usage', user, False, None, None, f"{user} was not found in {self.hub}")
+            data = get_system_usage(self.bucket, self.hub, user_id, backend, start_date, end_date, self.cache)
+        except requests.HTTPError as http_err:
+            return Result('usage', user, False, http_err.response.status_code, None, f"HTTPError: {http_err}")
+        except Exception as err:
+            return Result('usage', user, False, None, None, f"error: {err}")
+
+        return Result('usage', user, True, None, data, None)  # The data may come from the cache, without a request
+
+    # ---------------------------------------------------------------
+    # Running many operations
+
+    def submit(self, operation, *args, **kwargs):
+        '''Runs the method named <operation> with <args> on a worker thread. Returns a concurrent.futures.Future of
+            its Result'''
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        return self._executor.submit(getattr(self, operation), *args, **kwargs)
+
+    def batch(self, operations):
+        '''Runs <operations>, an iterable of (method name, *args) tuples such as ('remove_project', group, name),
+            <workers> at a time. Returns their Results in the same order'''
+        futures = [self.submit(operation[0], *operation[1:]) for operation in operations]
+
+        return [future.result() for future in futures]
+
+
+class AsyncHubClient(HubClient):
+    '''Same operations as HubClient, as coroutines sent through an async_client.AsyncTransport, so one thread can
+        have hundreds of requests in flight. batch() runs at most <workers> operations at once.
+
+        Example:
+            async with AsyncHubClient('my-hub', workers=200) as hub_client:
+                results = await hub_client.batch(('usage', email, 'backend1') for email in emails)'''
+
+    def __init__(self, hub, rate=10.0, workers=100, bucket=None, cache=None, transport=None):
+        super().__init__(hub, rate, workers, bucket, cache)
+        self.transport = transport or async_client.AsyncTransport()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    async def _send(self, operation, target, method, url, changes_hub=False, **kwargs):
+        try:
+            response = await send_async(self.bucket, self.transport, method, url, **kwargs)
+            response.raise_for_status()  # Checks if the request returned an error
+        except requests.HTTPError as http_err:
+            return Result(operation, target, False, http_err.response.status_code, None, f"HTTPError: {http_err}")
+        except Exception as err:
+            return Result(operation, target, False, None, None, f"error: {err}")
+        if changes_hub:
+            hub_snapshot.invalidate(self.hub)
+
+        try:
+            data = response.json()
+        except ValueError:
+            data = None  # Some endpoints answer with an empty body
+
+        return Result(operation, target, True, response.status_code, data, None)
+
+    async def get_devices(self, group, project=None):
+        target = group if project is None else f'{group}/{project}'
+        result = await self._send('get_devices', target, 'GET', self._devices_url(group, project))
+        if result.ok:
+            result = result._replace(data=parse_devices(result.data))
+
+        return result
+
+    async def set_device_priority(self, group, backend, priority, project=None):
+        # An invalid priority gives a Result right away instead of a coroutine
+        result = super().set_device_priority(group, backend, priority, project)
+        return await result if asyncio.iscoroutine(result) else result
+
+    async def _edit_users(self, action, group, project, emails, chunk_size):
+        url = f'{self.url}/Groups/{group}/Projects/{project}/users'
+        chunks = [emails[i:i + chunk_size] for i in range(0, len(emails), chunk_size)]
+        results = await async_client.gather(self._send(f'{action}_users', f'{group}/{project}', 'POST', url,
+                                                       changes_hub=True, json={action: chunk}) for chunk in chunks)
+        errors = {email: result.error for chunk, result in zip(chunks, results) for email in chunk}
+
+        failures = sum(error is not None for error in errors.values())
+        return Result(f'{action}_users', f'{group}/{project}', not failures, results[-1].status if results else None,
+                      errors, f"{failures} of {len(emails)} users could not be edited" if failures else None)
+
+    async def user_id(self, email, max_age=hub_snapshot.SNAPSHOT_TTL):
+        # The hub users are read on a thread, once per snapshot, so the other coroutines keep running
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, super().user_id, email, max_age)
+
+    async def usage(self, user, backend, start_date='', end_date=''):
+        try:
+            user_id = await self.user_id(user) if '@' in user else user
+            if user_id is None:
+                return Result('usage', user, False, None, None, f"{user} was not found in {self.hub}")
+            data = self.cache.get(self.hub, user_id, backend, start_date, end_date) if self.cache else None
+            if data is None:
+                response = await send_async(self.bucket, self.transport, 'GET',
+                                            system_usage_url(self.hub, user_id, backend, start_date, end_date))
+                response.raise_for_status()  # Checks if the request returned an error
+                data = response.json()["data"]
+                if self.cache is not None:
+                    self.cache.put(self.hub, user_id, backend, start_date, end_date, data)
+        except requests.HTTPError as http_err:
+            return Result('usage', user, False, http_err.response.status_code, None, f"HTTPError: {http_err}")
+        except Exception as err:
+            return Result('usage', user, False, None, None, f"error: {err}")
+
+        return Result('usage', user, True, None, data, None)
+
+    def submit(self, operation, *args, **kwargs):
+        '''Starts the method named <operation> with <args> as an asyncio task and returns the task'''
+        return asyncio.ensure_future(getattr(self, operation)(*args, **kwargs))
+
+    async def batch(self, operations):
+        '''Runs <operations>, an iterable of (method name, *args) tuples, <workers> at a time. Returns their Results
+            in the same order. If the caller is cancelled, the operations still running are cancelled too'''
+        return await async_client.gather((getattr(self, operation[0])(*operation[1:]) for operation in operations),
+                                         limit=self.workers)
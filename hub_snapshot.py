@@ -0,0 +1,105 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import os
+import time
+import threading
+import client
+import storage
+
+# Seconds a snapshot is used without asking the API whether it changed
+SNAPSHOT_TTL = int(os.environ.get('HUB_SNAPSHOT_TTL', 300))
+
+# Snapshots already loaded by this process, keyed by (hub, endpoint)
+_loaded = {}
+_lock = threading.Lock()
+
+
+class OfflineError(Exception):
+    '''Raised when running offline and there is no snapshot of the requested hub'''
+
+
+def get_snapshot(hub, endpoint='', max_age=SNAPSHOT_TTL, offline=False):
+    '''Returns the snapshot of /Network/{hub}{endpoint} as a dict with the keys data, fetched, etag and last_modified.
+
+        The snapshot on disk is used as is while it is less than <max_age> seconds old. After that the API is asked
+        for the data again with If-None-Match/If-Modified-Since, so it is only downloaded again if it changed.
+        With <offline> the snapshot on disk is always used and no request is sent.'''
+    key = (hub, endpoint)
+    path = storage.cache_path('snapshots', f"{hub}{endpoint.replace('/', '_')}.json")
+
+    with _lock:
+        snapshot = _loaded.get(key)
+        if snapshot is None:
+            snapshot = storage.read_json(path)
+
+        if offline:
+            if snapshot is None:
+                raise OfflineError(f"There is no snapshot of /Network/{hub}{endpoint}. Run once without --offline "
+                                   f"to create it")
+            _loaded[key] = snapshot
+            return snapshot
+
+        if snapshot is not None and time.time() - snapshot['fetched'] < max_age:
+            _loaded[key] = snapshot
+            return snapshot
+
+        # Only one process downloads the snapshot at a time, the others wait and then use it
+        with storage.locked(path):
+            on_disk = storage.read_json(path)
+            if on_disk is not None and time.time() - on_disk['fetched'] < max_age:
+                _loaded[key] = on_disk
+                return on_disk
+            snapshot = on_disk or snapshot
+
+            headers = {}
+            if snapshot is not None:
+                if snapshot.get('etag'):
+                    headers['If-None-Match'] = snapshot['etag']
+                if snapshot.get('last_modified'):
+                    headers['If-Modified-Since'] = snapshot['last_modified']
+
+            response = client.get(f'{client.API_URL}/Network/{hub}{endpoint}', headers=headers)
+            if response.status_code == 304 and snapshot is not None:
+                snapshot['fetched'] = time.time()
+            else:
+                response.raise_for_status()  # Checks if the request returned an error
+                snapshot = {'data': response.json(), 'fetched': time.time(), 'etag': response.headers.get('ETag'),
+                            'last_modified': response.headers.get('Last-Modified')}
+            storage.write_json(path, snapshot)
+
+        _loaded[key] = snapshot
+        return snapshot
+
+
+def get_hub_data(hub, max_age=SNAPSHOT_TTL, offline=False):
+    '''Returns the /Network/{hub} data: the groups and projects of the hub'''
+    return get_snapshot(hub, '', max_age, offline)['data']
+
+
+def get_hub_users(hub, max_age=SNAPSHOT_TTL, offline=False):
+    '''Returns the /Network/{hub}/users data: the groups, projects and users of the hub'''
+    return get_snapshot(hub, '/users', max_age, offline)['data']
+
+
+def invalidate(hub):
+    '''Drops the snapshots of <hub>, so the next read downloads it again. Called after creating or deleting groups,
+        projects or users, since a snapshot taken before would not show the change'''
+    with _lock:
+        for endpoint in ('', '/users'):
+            _loaded.pop((hub, endpoint), None)
+            path = storage.cache_path('snapshots', f"{hub}{endpoint.replace('/', '_')}.json")
+            if not os.path.exists(path):
+                continue
+            with storage.locked(path):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,246 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import os
+import sys
+import io
+import json
+import runpy
+import socket
+import argparse
+import threading
+import traceback
+import contextlib
+
+# Command name -> script it runs. The scripts are only imported when their command is run
+COMMANDS = {
+    'analytics': 'get_analytics_for_users',
+    'usage-rollup': 'get_usage_rollup',
+    'backend-info': 'get_backend_info',
+    'edit-backends': 'edit_backends',
+    'edit-backends-all': 'edit_backends_in_all_projects',
+    'edit-group': 'edit_group',
+    'edit-project': 'edit_project',
+    'edit-users': 'edit_users',
+    'reconcile': 'reconcile_hub',
+}
+
+# Options through which a command reads from stdin when given '-'. The daemon can't forward stdin, so it refuses them
+STDIN_OPTIONS = {
+    'edit-users': '-file',
+}
+
+# Modules imported by the daemon when it starts, so commands don't pay for them
+PRELOAD = ('requests', 'tracing', 'client', 'auth', 'storage', 'hub_snapshot', 'user_index', 'throttle', 'device_index',
+           'analytics', 'analytics_cache')
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+parser = argparse.ArgumentParser(description="Run any of the Hub Automation scripts, or 'serve' to start a daemon "
+                                             "that runs them without paying for the start up and login every time",
+                                 epilog="Commands: serve, " + ", ".join(COMMANDS))
+parser.add_argument('-socket', type=str, default=os.environ.get('HUBCTL_SOCKET'),
+                    help="Unix socket of the daemon. Commands are sent to the daemon listening on it, or run in this "
+                         "process if none is. Defaults to the HUBCTL_SOCKET environment variable")
+parser.add_argument('command', type=str, choices=['serve'] + list(COMMANDS), metavar='command',
+                    help="'serve' or the command to run. Run 'hubctl.py <command> -h' for its arguments")
+parser.add_argument('args', nargs=argparse.REMAINDER, help="Arguments of the command")
+
+
+def run_command(command, args):
+    '''Runs the script of <command> in this process with <args> as its arguments, as if it was run on its own.
+        The script may exit with sys.exit()'''
+    path = os.path.join(SCRIPT_DIR, f'{COMMANDS[command]}.py')
+    sys.argv = [path] + args
+    runpy.run_path(path, run_name='__main__')
+
+
+def exit_code(code):
+    '''Returns the exit status of a process that called sys.exit(<code>), printing <code> if it is a message'''
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+# ---------------------------------------------------------------
+# Daemon. It runs one command at a time in its own process, so the HTTP session, the access token and the snapshots
+# of the hubs are kept in memory from one command to the next.
+
+'''
+Protocol: the client sends one JSON line {"command": <str>, "args": [<str>], "cwd": <str>}. The daemon answers with
+JSON lines {"stream": "stdout" or "stderr", "data": <str>} as the command prints, then {"exit": <int>}.
+'''
+
+
+class StreamWriter:
+    '''File-like object sending what is written to it to the client as JSON lines. <lock> is shared by the writers of
+        a connection, so lines written from several threads are never mixed'''
+
+    def __init__(self, connection, stream, lock):
+        self.connection = connection
+        self.stream = stream
+        self.lock = lock
+
+    def write(self, data):
+        if data:
+            with self.lock:
+                self.connection.sendall((json.dumps({'stream': self.stream, 'data': data}) + '\n').encode())
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    @property
+    def buffer(self):
+        return BinaryWriter(self)
+
+
+class BinaryWriter:
+    '''The buffer of a StreamWriter, for scripts writing bytes to sys.stdout.buffer'''
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, data):
+        self.writer.write(bytes(data).decode(errors='replace'))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def reads_stdin(command, args):
+    '''Returns True if <args> make <command> read from stdin'''
+    option = STDIN_OPTIONS.get(command)
+    if option is None:
+        return False
+
+    return any(arg == option and value == '-' for arg, value in zip(args, args[1:])) or f'{option}=-' in args
+
+
+@contextlib.contextmanager
+def redirect_stdin(stream):
+    stdin = sys.stdin
+    sys.stdin = stream
+    try:
+        yield
+    finally:
+        sys.stdin = stdin
+
+
+def handle(connection):
+    '''Runs the command sent on <connection> and sends back its output and exit status'''
+    with connection, connection.makefile('r') as reader:
+        message = json.loads(reader.readline())
+        lock = threading.Lock()
+        stdout = StreamWriter(connection, 'stdout', lock)
+        stderr = StreamWriter(connection, 'stderr', lock)
+        code = 0
+        cwd = os.getcwd()
+        try:
+            if reads_stdin(message['command'], message['args']):
+                stderr.write("The daemon can't read from the stdin of the client. Pass a file instead of '-', "
+                             "or run the command without the daemon\n")
+                connection.sendall((json.dumps({'exit': 2}) + '\n').encode())
+                return
+            os.chdir(message['cwd'])  # Scripts read and write their files in the directory they are run from
+            # Commands never read the stdin of the daemon, which would block it
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr), \
+                    redirect_stdin(io.StringIO()):
+                try:
+                    run_command(message['command'], message['args'])
+                except SystemExit as exit_err:
+                    code = exit_code(exit_err.code)
+                except Exception:
+                    traceback.print_exc()
+                    code = 1
+            connection.sendall((json.dumps({'exit': code}) + '\n').encode())
+        except OSError:
+            pass  # The client went away, the command's output is lost
+        finally:
+            os.chdir(cwd)
+
+
+def serve(path):
+    '''Listens on the Unix socket <path> and runs the commands sent to it, one at a time'''
+    for module in PRELOAD:
+        __import__(module)
+    import client
+    client.get_session()
+
+    if os.path.exists(path):
+        os.unlink(path)  # Left by a daemon that didn't stop cleanly
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)  # Commands run with the access token of the daemon, so only its user may connect
+    server.listen()
+    print(f"Listening on {path}")
+
+    try:
+        while True:
+            connection, _ = server.accept()
+            handle(connection)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(path)
+
+
+def send_command(path, command, args):
+    '''Runs <command> with <args> in the daemon listening on <path> and prints its output as it comes.
+        Returns the exit status of the command, or None if no daemon is listening.'''
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError:
+        connection.close()
+        return None
+
+    with connection, connection.makefile('r') as reader:
+        connection.sendall((json.dumps({'command': command, 'args': args, 'cwd': os.getcwd()}) + '\n').encode())
+        for line in reader:
+            message = json.loads(line)
+            if 'exit' in message:
+                return message['exit']
+            stream = sys.stdout if message['stream'] == 'stdout' else sys.stderr
+            stream.write(message['data'])
+            stream.flush()
+
+    sys.exit("The daemon stopped before the command finished")
+
+
+if __name__ == '__main__':
+    arguments = parser.parse_args()
+
+    if arguments.command == 'serve':
+        serve_parser = argparse.ArgumentParser(prog='hubctl.py serve', description="Start the daemon")
+        serve_parser.add_argument('-socket', type=str, default=arguments.socket,
+                                  help="Unix socket to listen on. Defaults to ~/.hub_automation/hubctl.sock")
+        socket_path = serve_parser.parse_args(arguments.args).socket
+        if not hasattr(socket, 'AF_UNIX'):
+            sys.exit("The daemon needs Unix sockets, which this platform doesn't have")
+        import storage
+        serve(socket_path or storage.cache_path('hubctl.sock'))
+        sys.exit()
+
+    if arguments.socket is not None and hasattr(socket, 'AF_UNIX'):
+        status = send_command(arguments.socket, arguments.command, arguments.args)
+        if status is not None:
+            sys.exit(status)
+        print(f"No daemon is listening on {arguments.socket}, running the command in this process", file=sys.stderr)
+
+    run_command(arguments.command, arguments.args)
@@ -0,0 +1,336 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+import urllib.parse
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+parser = argparse.ArgumentParser(description="Local stand-in for the Network API with a synthetic hub, to test and "
+                                             "benchmark the scripts without using the real API. Run the scripts "
+                                             "with HUB_API_URL=http://127.0.0.1:<port>/api and "
+                                             "HUB_LOGIN_URL=http://127.0.0.1:<port>/api/users/loginWithToken")
+parser.add_argument('-port', type=int, default=8765, help="Port to listen on")
+parser.add_argument('-hub', type=str, default='mock-hub', help="Name of the synthetic hub")
+parser.add_argument('-groups', type=int, default=10, help="Number of groups in the hub")
+parser.add_argument('-projects', type=int, default=10, help="Number of projects in each group")
+parser.add_argument('-users', type=int, default=20, help="Number of users in each project")
+parser.add_argument('-user_pool', type=int, help="Number of different users. Users are picked at random from the "
+                                                 "pool, so with a small pool they belong to several projects. "
+                                                 "Defaults to half the number of project memberships")
+parser.add_argument('-backends', type=int, default=5, help="Number of backends in the hub")
+parser.add_argument('-latency', type=float, default=0.05, help="Seconds every answer is delayed by")
+parser.add_argument('-jitter', type=float, default=0.02, help="Extra random delay of up to this many seconds")
+parser.add_argument('-error_rate', type=float, default=0.0, help="Fraction of requests answered with a 500 error")
+parser.add_argument('-rate_limit', type=float, default=0.0, help="Requests per second accepted before answering "
+                                                                 "with 429 and a Retry-After header. 0 for no limit")
+parser.add_argument('-retry_after', type=float, default=1.0, help="Seconds given in the Retry-After header of 429s")
+parser.add_argument('-token_ttl', type=int, default=3600, help="Seconds the access tokens are valid for")
+parser.add_argument('-seed', type=int, default=0, help="Seed of the synthetic hub, the same seed gives the same hub")
+
+
+class MockHub:
+    '''Synthetic hub kept in memory. All the changes are made under <lock>, and every change raises <version>,
+        which is sent as the ETag of the hub data.'''
+
+    def __init__(self, name, groups, projects, users, user_pool, backends, seed):
+        rng = random.Random(seed)
+        self.name = name
+        self.lock = threading.Lock()
+        self.version = 0
+        self._serialized = {}
+        self.backends = [f'mock_backend_{i}' for i in range(backends)]
+        user_pool = user_pool or max(1, groups * projects * users // 2)
+        pool = [(f'u{i:07d}', f'user{i}@example.com') for i in range(user_pool)]
+
+        self.data = {'hubId': name, 'id': name, 'name': name, 'users': {}, 'groups': {}}
+        self.devices = {}  # (group, project or None) -> {backend_name: priority}
+        for user_id, email in pool[:2]:
+            self.data['users'][user_id] = self._user(email, 'admin')
+        for g in range(groups):
+            group_name = f'group{g:04d}'
+            admin_id, admin_email = rng.choice(pool)
+            group = {'name': group_name, 'title': group_name, 'users': {admin_id: self._user(admin_email, 'admin')},
+                     'projects': {}}
+            self.devices[(group_name, None)] = {backend: 100 for backend in self.backends}
+            for p in range(projects):
+                project_name = f'project{p:03d}'
+                members = rng.sample(pool, min(users, len(pool)))
+                group['projects'][project_name] = {'name': project_name, 'title': project_name, 'deleted': False,
+                                                   'users': {user_id: self._user(email) for user_id, email in members}}
+                self.devices[(group_name, project_name)] = {backend: rng.choice([10, 100, 1000])
+                                                            for backend in rng.sample(self.backends,
+                                                                                      rng.randint(1, backends))}
+            self.data['groups'][group_name] = group
+
+    @staticmethod
+    def _user(email, role=None):
+        user = {'email': email, 'name': email.split('@')[0], 'deleted': False, 'dateJoined': '2021-01-01T00:00:00Z'}
+        if role is not None:
+            user['role'] = role
+        return user
+
+    def serialized(self):
+        '''Returns (etag, JSON bytes) of the hub data. The bytes are only built again after a change'''
+        with self.lock:
+            if self.version not in self._serialized:
+                self._serialized = {self.version: json.dumps(self.data).encode()}
+            return f'"{self.version}"', self._serialized[self.version]
+
+    def changed(self):
+        self.version += 1
+
+
+HUB_PATH = r'/api/Network/(?P<hub>[^/]+)'
+GROUP_PATH = HUB_PATH + r'/Groups/(?P<group>[^/]+)'
+PROJECT_PATH = GROUP_PATH + r'/Projects/(?P<project>[^/]+)'
+DEVICES_PATH = GROUP_PATH + r'(/Projects/(?P<project>[^/]+))?/devices'  # Devices of a group or of a project
+
+# Requests are matched in this order. Names are the endpoints counted in /stats
+ROUTES = [
+    ('POST', 'login', r'/api/users/loginWithToken'),
+    ('GET', 'hub_data', HUB_PATH),
+    ('GET', 'hub_users', HUB_PATH + '/users'),
+    ('GET', 'hub_devices', HUB_PATH + '/devices'),
+    ('GET', 'analytics', HUB_PATH + '/analytics/system-usage'),
+    ('POST', 'add_group', HUB_PATH + '/Groups'),
+    ('DELETE', 'remove_group', GROUP_PATH),
+    ('POST', 'add_project', GROUP_PATH + '/Projects'),
+    ('DELETE', 'remove_project', PROJECT_PATH),
+    ('POST', 'edit_users', PROJECT_PATH + '/users'),
+    ('GET', 'get_devices', DEVICES_PATH),
+    ('POST', 'set_device', DEVICES_PATH),
+    ('DELETE', 'remove_device', DEVICES_PATH + '/(?P<backend>[^/]+)'),
+]
+ROUTES = [(method, name, re.compile(pattern + '$')) for method, name, pattern in ROUTES]
+
+
+class RateLimiter:
+    '''Accepts <rate> requests per second, with bursts of up to one second of requests'''
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def count(name):
+    with stats_lock:
+        stats[name] += 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keeps connections alive, like the real API
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def reply(self, status, body=None, headers=None):
+        content = b'' if body is None else body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        count(f'status_{status}')
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Type', '').startswith('application/json') and body:
+            return json.loads(body)
+        return {}
+
+    def handle_request(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        body = self.read_body()
+        if url.path == '/stats':
+            with stats_lock:
+                counts = dict(stats)
+            return self.reply(200, counts)
+
+        for route_method, name, pattern in ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                break
+        else:
+            count('not_found')
+            return self.reply(404, {'error': {'message': f'{method} {url.path} is not an endpoint of the mock'}})
+        count(name)
+        params = match.groupdict()
+
+        time.sleep(args.latency + random.uniform(0, args.jitter))
+        if limiter is not None and not limiter.allow():
+            return self.reply(429, {'error': {'message': 'Too many requests'}}, {'Retry-After': str(args.retry_after)})
+        if name == 'login':
+            token = f'mock-{random.getrandbits(64):016x}'
+            with tokens_lock:
+                tokens[token] = time.time() + args.token_ttl
+            return self.reply(200, {'id': token, 'ttl': args.token_ttl, 'userId': 'mock-user'})
+
+        with tokens_lock:
+            if tokens.get(self.headers.get('X-Access-Token'), 0) < time.time():
+                return self.reply(401, {'error': {'message': 'AUTHORIZATION_REQUIRED'}})
+        if random.random() < args.error_rate:
+            return self.reply(500, {'error': {'message': 'Synthetic error'}})
+        if params.get('hub') != hub.name:
+            return self.reply(404, {'error': {'message': f"Hub {params.get('hub')} doesn't exist"}})
+
+        return getattr(self, name)(params, urllib.parse.parse_qs(url.query), body)
+
+    # ---------------------------------------------------------------
+    # Endpoints
+
+    def hub_data(self, params, query, body):
+        etag, content = hub.serialized()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            count('status_304')
+            return
+        self.reply(200, content, {'ETag': etag})
+
+    hub_users = hub_data  # The scripts only use the groups, projects and users, which both endpoints return
+
+    def hub_devices(self, params, query, body):
+        self.reply(200, [{'specificConfiguration': {'backend_name': backend, 'n_qubits': 5 + i}}
+                         for i, backend in enumerate(hub.backends)])
+
+    def analytics(self, params, query, body):
+        try:
+            options = json.loads(query['options'][0])
+            key = f"{options['userId']}/{options['backend']}/{options.get('startDate')}/{options.get('endDate')}"
+        except (KeyError, ValueError):
+            return self.reply(400, {'error': {'message': 'Invalid options'}})
+        seed = zlib.crc32(key.encode())
+        jobs = seed % 100
+        self.reply(200, {'data': {'jobs': jobs, 'executions': jobs * 4, 'queueTime': seed % 100000,
+                                  'runTime': seed % 50000, 'averageRunTime': (seed % 50000) // max(jobs, 1),
+                                  'averageQueueTime': (seed % 100000) // max(jobs, 1)}})
+
+    def add_group(self, params, query, body):
+        with hub.lock:
+            if body.get('name') in hub.data['groups']:
+                return self.reply(409, {'error': {'message': 'Group already exists'}})
+            hub.data['groups'][body['name']] = {'name': body['name'], 'title': body.get('title'), 'users': {},
+                                                'projects': {}}
+            hub.devices[(body['name'], None)] = {}
+            hub.changed()
+        self.reply(200, {'name': body['name']})
+
+    def remove_group(self, params, query, body):
+        with hub.lock:
+            if hub.data['groups'].pop(params['group'], None) is None:
+                return self.reply(404, {'error': {'message': 'Group not found'}})
+            hub.changed()
+        self.reply(200, {'ok': True})
+
+    def add_project(self, params, query, body):
+        with hub.lock:
+            group = hub.data['groups'].get(params['group'])
+            if group is None:
+                return self.reply(404, {'error': {'message': 'Group not found'}})
+            group['projects'][body['name']] = {'name': body['name'], 'title': body.get('title'), 'deleted': False,
+                                               'users': {}}
+            hub.devices[(params['group'], body['name'])] = {}
+            hub.changed()
+        self.reply(200, {'name': body['name']})
+
+    def remove_project(self, params, query, body):
+        with hub.lock:
+            group = hub.data['groups'].get(params['group'], {'projects': {}})
+            if group['projects'].pop(params['project'], None) is None:
+                return self.reply(404, {'error': {'message': 'Project not found'}})
+            hub.changed()
+        self.reply(200, {'ok': True})
+
+    def edit_users(self, params, query, body):
+        with hub.lock:
+            project = hub.data['groups'].get(params['group'], {'projects': {}})['projects'].get(params['project'])
+            if project is None:
+                return self.reply(404, {'error': {'message': 'Project not found'}})
+            for email in body.get('add', []):
+                project['users'][f'u{zlib.crc32(email.lower().encode()):010d}'] = hub._user(email)
+            removed = {email.lower() for email in body.get('remove', [])}
+            project['users'] = {user_id: user for user_id, user in project['users'].items()
+                                if user['email'].lower() not in removed}
+            hub.changed()
+        self.reply(200, {'ok': True})
+
+    def get_devices(self, params, query, body):
+        devices = hub.devices.get((params['group'], params['project']))
+        if devices is None:
+            return self.reply(404, {'error': {'message': 'Group or project not found'}})
+        self.reply(200, [{'backend_name': backend, 'priority': priority} for backend, priority in devices.items()])
+
+    def set_device(self, params, query, body):
+        with hub.lock:
+            devices = hub.devices.get((params['group'], params['project']))
+            if devices is None:
+                return self.reply(404, {'error': {'message': 'Group or project not found'}})
+            devices[body['name']] = body.get('priority')
+        self.reply(200, {'backend_name': body['name'], 'priority': body.get('priority')})
+
+    def remove_device(self, params, query, body):
+        with hub.lock:
+            devices = hub.devices.get((params['group'], params['project']), {})
+            if devices.pop(params['backend'], None) is None:
+                return self.reply(404, {'error': {'message': 'Backend not found'}})
+        self.reply(200, {'ok': True})
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    hub = MockHub(args.hub, args.groups, args.projects, args.users, args.user_pool, args.backends, args.seed)
+    limiter = RateLimiter(args.rate_limit) if args.rate_limit > 0 else None
+    tokens = {}
+    tokens_lock = threading.Lock()
+    stats = Counter()  # Number of requests per endpoint and per status code, returned by /stats
+    stats_lock = threading.Lock()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), Handler)
+    server.daemon_threads = True
+    print(f"Serving {args.hub} ({args.groups} groups of {args.projects} projects) on "
+          f"http://127.0.0.1:{server.server_address[1]}/api", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit()
@@ -0,0 +1,261 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import sys
+import json
+import requests
+import argparse
+import warnings
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import client
+import hub_snapshot
+from device_index import get_devices
+from throttle import TokenBucket, send
+
+try:
+    import yaml
+except ImportError:  # YAML state files can only be read if PyYAML is installed
+    yaml = None
+
+API_URL = client.API_URL
+
+parser = argparse.ArgumentParser(description="Compare the groups, projects, users and backends of your Hub with a "
+                                             "desired state file, and make the changes needed to match it")
+parser.add_argument('hub', type=str, help="The Hub to reconcile")
+parser.add_argument('action', type=str, choices=['plan', 'apply'], help="'plan' only prints the changes, 'apply' "
+                                                                        "makes them")
+parser.add_argument('state_file', type=str, help="JSON or YAML file describing the desired state of the Hub")
+parser.add_argument('--prune', action="store_true", help="Remove the groups and projects that are not in the "
+                                                         "state file")
+parser.add_argument('-workers', type=int, default=8, help="Number of requests sent at the same time")
+parser.add_argument('-rate', type=float, default=10.0, help="Maximum number of requests per second. The rate is "
+                                                            "lowered automatically if the API asks us to slow down")
+
+args = parser.parse_args()
+
+hub = args.hub
+action = args.action
+state_file = args.state_file
+prune = args.prune
+workers = args.workers
+rate = args.rate
+
+if workers < 1 or rate <= 0:
+    sys.exit("-workers and -rate must both be greater than 0")
+
+'''
+Format for the desired state file. Every key but "groups" is optional. When "users" or "devices" is given, it is the
+complete list for that group or project: missing entries are added and the others are removed. Groups that are not
+listed, and projects not listed in the "projects" of their group, are only removed with --prune. A group without
+"projects" keeps its projects. "title" and "share" are used when a group or project is created; the ones of existing
+groups and projects can't be changed, so a warning is printed if they differ.
+
+groups:
+    group_name:
+        title: <str>
+        share: <int>
+        devices: {backend_name: <priority>}
+        projects:
+            project_name:
+                title: <str>
+                share: <int>
+                users: [<email>]
+                devices: {backend_name: <priority>}
+'''
+
+# Operations are applied stage by stage, so a project is never created before its group or a user before its project
+Operation = namedtuple('Operation', ['stage', 'method', 'url', 'json', 'description'])
+STAGE_CREATE_GROUPS = 0
+STAGE_CREATE_PROJECTS = 1
+STAGE_MEMBERS = 2
+STAGE_REMOVE_PROJECTS = 3
+STAGE_REMOVE_GROUPS = 4
+
+# Maximum number of users added to or removed from a project in one request
+USERS_CHUNK_SIZE = 100
+
+
+def load_state(path):
+    '''Reads the desired state file. Files ending in .yaml or .yml are read as YAML, others as JSON'''
+    with open(path, 'r') as file:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                sys.exit("PyYAML must be installed to read YAML state files. Use a JSON file or run "
+                         "'pip install pyyaml'")
+            return yaml.safe_load(file)
+        return json.load(file)
+
+
+def diff_devices(current, desired, url, where):
+    '''Returns the operations that make the devices at <url> go from <current> to <desired>'''
+    operations = []
+    for backend, priority in desired.items():
+        # If the API doesn't return the priority of the current devices, it is set again to be safe
+        if backend not in current or current[backend] is None or current[backend] != priority:
+            operations.append(Operation(STAGE_MEMBERS, 'POST', url, {'name': backend, 'priority': priority},
+                                        f"Set {backend} with priority {priority} in {where}"))
+    for backend in current:
+        if backend not in desired:
+            operations.append(Operation(STAGE_MEMBERS, 'DELETE', f'{url}/{backend}', None,
+                                        f"Remove {backend} from {where}"))
+
+    return operations
+
+
+def check_settings(current, desired, where):
+    '''Warns if the title or share of the existing group or project <where> differ from the <desired> ones, since they
+        can't be changed'''
+    for field, current_field in (('title', 'title'), ('share', 'priority')):
+        if field in desired and current.get(current_field) is not None and current[current_field] != desired[field]:
+            warnings.warn(f"Warning: the {field} of {where} is {json.dumps(current[current_field])} in the Hub and "
+                          f"{json.dumps(desired[field])} in the state file. It can't be changed by this script")
+
+
+def plan(current, desired):
+    '''Compares the <current> /Network/{hub}/users data with the <desired> state and returns the list of operations
+        needed to go from one to the other'''
+    operations = []
+    current_groups = current.get("groups", {})
+    desired_groups = desired.get("groups") or {}
+    device_reads = {}
+
+    for group_name, group in desired_groups.items():
+        group = group or {}
+        group_url = f'{API_URL}/Network/{hub}/Groups/{group_name}'
+        current_projects = {}
+        if group_name in current_groups:
+            check_settings(current_groups[group_name], group, group_name)
+            projects = current_groups[group_name].get("projects", {})
+            current_projects = {name: project for name, project in projects.items()
+                                if not project.get("deleted", False)}
+        else:
+            operations.append(Operation(STAGE_CREATE_GROUPS, 'POST', f'{API_URL}/Network/{hub}/Groups',
+                                        {"name": group_name, "title": group.get("title", group_name),
+                                         "priority": group.get("share")},
+                                        f"Create group {group_name}"))
+
+        if "devices" in group:
+            device_reads[(group_url + '/devices', group_name)] = (group["devices"] or {}, group_name in current_groups)
+
+        desired_projects = group.get("projects") or {}
+        for project_name, project in desired_projects.items():
+            project = project or {}
+            project_url = f'{group_url}/Projects/{project_name}'
+            where = f'{group_name}/{project_name}'
+            if project_name in current_projects:
+                check_settings(current_projects[project_name], project, where)
+            else:
+                operations.append(Operation(STAGE_CREATE_PROJECTS, 'POST', f'{group_url}/Projects',
+                                            {"name": project_name, "title": project.get("title", project_name),
+                                             "priority": project.get("share")},
+                                            f"Create project {where}"))
+
+            if "users" in project:
+                current_users = {user["email"].lower(): user["email"]
+                                 for user in current_projects.get(project_name, {}).get("users", {}).values()
+                                 if not user.get("deleted", False)}
+                desired_users = {email.lower(): email for email in project["users"] or []}
+                to_add = [email for key, email in desired_users.items() if key not in current_users]
+                to_remove = [email for key, email in current_users.items() if key not in desired_users]
+                # The users endpoint takes lists, so each request adds or removes up to USERS_CHUNK_SIZE users
+                for i in range(0, len(to_add), USERS_CHUNK_SIZE):
+                    chunk = to_add[i:i + USERS_CHUNK_SIZE]
+                    operations.append(Operation(STAGE_MEMBERS, 'POST', f'{project_url}/users', {"add": chunk},
+                                                f"Add {len(chunk)} users to {where}: {', '.join(chunk)}"))
+                for i in range(0, len(to_remove), USERS_CHUNK_SIZE):
+                    chunk = to_remove[i:i + USERS_CHUNK_SIZE]
+                    operations.append(Operation(STAGE_MEMBERS, 'POST', f'{project_url}/users', {"remove": chunk},
+                                                f"Remove {len(chunk)} users from {where}: {', '.join(chunk)}"))
+
+            if "devices" in project:
+                device_reads[(project_url + '/devices', where)] = (project["devices"] or {},
+                                                                   project_name in current_projects)
+
+        # Projects are only managed for the groups that list them
+        if prune and "projects" in group:
+            for project_name in current_projects:
+                if project_name not in desired_projects:
+                    operations.append(Operation(STAGE_REMOVE_PROJECTS, 'DELETE', f'{group_url}/Projects/{project_name}',
+                                                None, f"Remove project {group_name}/{project_name}"))
+
+    if prune:
+        for group_name in current_groups:
+            if group_name not in desired_groups:
+                operations.append(Operation(STAGE_REMOVE_GROUPS, 'DELETE',
+                                            f'{API_URL}/Network/{hub}/Groups/{group_name}', None,
+                                            f"Remove group {group_name}"))
+
+    # Read the devices of the existing groups and projects that list devices, all at the same time
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {key: executor.submit(get_devices, bucket, key[0])
+                   for key, (_, exists) in device_reads.items() if exists}
+        for (url, where), (desired_devices, exists) in device_reads.items():
+            current_devices = futures[(url, where)].result() if exists else {}
+            operations.extend(diff_devices(current_devices, desired_devices, url, where))
+
+    return sorted(operations, key=lambda operation: operation.stage)
+
+
+def apply_operation(operation):
+    '''Sends the request of <operation> and returns None, or the error if it failed'''
+    try:
+        response = send(bucket, operation.method, operation.url, json=operation.json)
+        response.raise_for_status()  # Checks if the request returned an error
+    except requests.HTTPError as http_err:
+        return f"HTTPError: {http_err}"
+    except Exception as err:
+        return f"error: {err}"
+
+    return None
+
+
+bucket = TokenBucket(rate, burst=workers)
+
+try:
+    desired_state = load_state(state_file)
+    current_state = hub_snapshot.get_hub_users(hub, max_age=0)
+    operations = plan(current_state, desired_state)
+except requests.HTTPError as http_err:
+    sys.exit(f"Could not read the current state of {hub} due to HTTPError: {http_err}")
+except Exception as err:
+    sys.exit(f"Could not plan the changes to {hub} due to: {err}")
+
+if not operations:
+    print(f"{hub} already matches {state_file}. Nothing to do")
+    sys.exit()
+
+for operation in operations:
+    print(operation.description)
+print(f"{len(operations)} changes needed")
+
+if action == 'plan':
+    sys.exit()
+
+# Apply the operations of each stage at the same time. A stage only starts if the previous one fully succeeded,
+# since its operations may depend on it
+with ThreadPoolExecutor(max_workers=workers) as executor:
+    for stage in sorted(set(operation.stage for operation in operations)):
+        stage_operations = [operation for operation in operations if operation.stage == stage]
+        errors = list(executor.map(apply_operation, stage_operations))
+        if any(error is None for error in errors):
+            hub_snapshot.invalidate(hub)  # The saved snapshots don't show the changes
+
+        failures = 0
+        for operation, error in zip(stage_operations, errors):
+            if error is None:
+                print(f"Done: {operation.description}")
+            else:
+                print(f"Failed: {operation.description} due to {error}")
+                failures += 1
+        if failures:
+            sys.exit(f"{failures} changes failed. The changes that depend on them were not made")
+
+print(f"{hub} now matches {state_file}")
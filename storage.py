@@ -0,0 +1,65 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl, files are then used without locking
+    fcntl = None
+
+# Directory where the scripts keep the data they share between runs
+CACHE_DIR = os.environ.get('HUB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.hub_automation'))
+
+
+def cache_path(*parts):
+    '''Returns the path of <parts> inside CACHE_DIR, creating the parent directories if needed'''
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+
+    return path
+
+
+@contextmanager
+def locked(path):
+    '''Holds an exclusive lock on <path> for the duration of the with block, so that several processes
+        can safely read and update the same file'''
+    with open(f'{path}.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_json(path):
+    '''Returns the JSON content of <path>, or None if the file is missing or unreadable'''
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    '''Writes <data> to <path> as JSON. The file is replaced in one step, so readers never see a partial file'''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,147 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import time
+import asyncio
+import threading
+import email.utils
+import client
+import tracing
+
+# Status codes the API uses to tell us to slow down
+RETRY_STATUS_CODES = (429, 503)
+MAX_RETRIES = 5
+
+
+def parse_retry_after(value):
+    '''Converts a Retry-After header value into a number of seconds to wait.
+
+        The header may either be a number of seconds or an HTTP date. Returns None if it can't be parsed.'''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    '''Thread safe token bucket used to pace requests to the API.
+
+        Tokens are added at <rate> per second up to <burst>. Every request takes one token. When the server
+        answers with 429 or 503 the rate is halved and every caller waits until the Retry-After time has passed.
+        Each successful request slowly raises the rate again, up to the <rate> we started with.'''
+
+    def __init__(self, rate, burst=1, min_rate=0.05):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self):
+        '''Takes a token if one is available and returns None, else returns the number of seconds to wait before
+            trying again'''
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return None
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        '''Blocks until a token is available and returns the number of seconds spent waiting'''
+        waited = 0.0
+        while True:
+            delay = self._take()
+            if delay is None:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def acquire_async(self):
+        '''Same as acquire(), but lets the other coroutines run while waiting'''
+        waited = 0.0
+        while True:
+            delay = self._take()
+            if delay is None:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def backoff(self, delay=None):
+        '''Halves the request rate and, if given, stops all callers for <delay> seconds'''
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            if delay:
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def recover(self):
+        '''Slowly raises the request rate back up to its starting value after a successful request'''
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+def send(bucket, method, url, max_retries=MAX_RETRIES, **kwargs):
+    '''Sends a request paced by <bucket>, retrying when the server answers with 429 or 503.
+
+        The Retry-After header is honoured when present, otherwise an exponential delay is used.
+        Returns the last response received, so callers should still call raise_for_status().'''
+    attempt = 0
+    while True:
+        tracing.record_wait(method, url, bucket.acquire())
+        response = client.request(method, url, **kwargs)
+        if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+            if response.ok:
+                bucket.recover()
+            return response
+
+        delay = parse_retry_after(response.headers.get('Retry-After'))
+        if delay is None:
+            delay = min(60, 2 ** attempt)
+        bucket.backoff(delay)
+        attempt += 1
+
+
+async def send_async(bucket, transport, method, url, max_retries=MAX_RETRIES, **kwargs):
+    '''Same as send(), but sends the request through the async_client.AsyncTransport <transport>'''
+    attempt = 0
+    while True:
+        tracing.record_wait(method, url, await bucket.acquire_async())
+        response = await transport.request(method, url, **kwargs)
+        if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+            if response.ok:
+                bucket.recover()
+            return response
+
+        delay = parse_retry_after(response.headers.get('Retry-After'))
+        if delay is None:
+            delay = min(60, 2 ** attempt)
+        bucket.backoff(delay)
+        attempt += 1
@@ -0,0 +1,215 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import os
+import sys
+import json
+import time
+import atexit
+import bisect
+import threading
+import urllib.parse
+
+# HUB_TRACE=1 prints a summary of the requests per endpoint when the script exits. HUB_TRACE_FILE writes one JSON
+# line per request and per throttle wait to the given file, and HUB_METRICS_FILE writes the metrics to the given
+# file in the Prometheus/OpenMetrics text format when the script exits. Nothing is recorded if none of them is set.
+SUMMARY = os.environ.get('HUB_TRACE', '0') != '0'
+TRACE_FILE = os.environ.get('HUB_TRACE_FILE')
+METRICS_FILE = os.environ.get('HUB_METRICS_FILE')
+ENABLED = SUMMARY or bool(TRACE_FILE) or bool(METRICS_FILE)
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+# Path segments followed by a name, which endpoint templates replace with a placeholder
+PLACEHOLDERS = {'Network': '{hub}', 'Groups': '{group}', 'Projects': '{project}', 'devices': '{backend}'}
+
+_started = time.monotonic()
+_lock = threading.Lock()
+_endpoints = {}  # (method, endpoint) -> EndpointStats
+_trace = None
+
+
+class EndpointStats:
+    '''Requests sent to one endpoint: their latency histogram, status codes, bytes received and time throttled'''
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.statuses = {}  # Status code, or 'error' if no response was received -> number of requests
+        self.bytes = 0
+        self.throttled = 0.0
+
+    def add(self, status, size, latency):
+        self.buckets[bisect.bisect_left(BUCKETS, latency)] += 1
+        self.count += 1
+        self.latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes += size
+
+    @property
+    def errors(self):
+        return sum(count for status, count in self.statuses.items() if status == 'error' or status >= 400)
+
+    def quantile(self, q):
+        '''Estimates the <q> quantile of the latency from the histogram, interpolating inside the bucket it falls in'''
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = min(BUCKETS[i], self.max_latency)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+
+        return self.max_latency
+
+
+def endpoint(url):
+    '''Returns the path of <url> with the names of hubs, groups, projects and backends replaced by placeholders,
+        such as /api/Network/{hub}/Groups/{group}/devices'''
+    segments = urllib.parse.urlsplit(url).path.split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in PLACEHOLDERS and segments[i]:
+            segments[i] = PLACEHOLDERS[segments[i - 1]]
+
+    return '/'.join(segments)
+
+
+def _stats(method, url):
+    key = (method.upper(), endpoint(url))
+    if key not in _endpoints:
+        _endpoints[key] = EndpointStats()
+
+    return key, _endpoints[key]
+
+
+def _write_trace(event):
+    global _trace
+    if _trace is None:
+        _trace = open(TRACE_FILE, 'a', buffering=1)
+    _trace.write(json.dumps(event) + '\n')
+
+
+def record(method, url, response, latency):
+    '''Records a request that took <latency> seconds. <response> is None if no response was received'''
+    if not ENABLED:
+        return
+    status = 'error' if response is None else response.status_code
+    size = 0 if response is None else len(response.content)
+    with _lock:
+        key, stats = _stats(method, url)
+        stats.add(status, size, latency)
+        if TRACE_FILE:
+            _write_trace({'time': round(time.time(), 6), 'event': 'request', 'method': key[0], 'endpoint': key[1],
+                          'status': status, 'bytes': size, 'latency': round(latency, 6)})
+
+
+def record_wait(method, url, waited):
+    '''Records that a request waited <waited> seconds for the rate limiter before being sent'''
+    if not ENABLED or not waited:
+        return
+    with _lock:
+        key, stats = _stats(method, url)
+        stats.throttled += waited
+        if TRACE_FILE:
+            _write_trace({'time': round(time.time(), 6), 'event': 'throttle', 'method': key[0], 'endpoint': key[1],
+                          'wait': round(waited, 6)})
+
+
+def print_summary(file=None):
+    '''Prints the number of requests, errors, latencies, bytes and time throttled of every endpoint'''
+    file = file or sys.stderr
+    with _lock:
+        endpoints = sorted(_endpoints.items(), key=lambda item: -item[1].latency)
+    if not endpoints:
+        return
+
+    width = max(len(f'{method} {path}') for method, path in dict(endpoints)) + 1
+    print(f"\nAPI requests in {time.monotonic() - _started:.1f}s:", file=file)
+    print(f"{'Endpoint':<{width}}{'Requests':>9}{'Errors':>7}{'Total s':>9}{'p50 ms':>8}{'p95 ms':>8}{'Max ms':>8}"
+          f"{'KB':>9}{'Throttled s':>12}", file=file)
+    for (method, path), stats in endpoints:
+        print(f"{method + ' ' + path:<{width}}{stats.count:>9}{stats.errors:>7}{stats.latency:>9.2f}"
+              f"{stats.quantile(0.5) * 1000:>8.0f}{stats.quantile(0.95) * 1000:>8.0f}{stats.max_latency * 1000:>8.0f}"
+              f"{stats.bytes / 1024:>9.1f}{stats.throttled:>12.2f}", file=file)
+
+    # Latency histogram of all the requests
+    total = [sum(stats.buckets[i] for _, stats in endpoints) for i in range(len(BUCKETS))]
+    largest = max(total) or 1
+    print("\nLatency of all requests:", file=file)
+    for i, count in enumerate(total):
+        bound = f'<= {BUCKETS[i] * 1000:g} ms' if BUCKETS[i] != float('inf') else f'>  {BUCKETS[i - 1] * 1000:g} ms'
+        print(f"  {bound:>12} {count:>8} {'#' * round(40 * count / largest)}".rstrip(), file=file)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def metrics():
+    '''Returns the metrics in the OpenMetrics text format, which Prometheus can also read'''
+    with _lock:
+        endpoints = sorted(_endpoints.items())
+
+    lines = ['# TYPE hub_api_request_duration_seconds histogram',
+             '# HELP hub_api_request_duration_seconds Latency of the requests to the API.']
+    for (method, path), stats in endpoints:
+        labels = f'method="{_label(method)}",endpoint="{_label(path)}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS, stats.buckets):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else bound
+            lines.append(f'hub_api_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f'hub_api_request_duration_seconds_count{{{labels}}} {stats.count}')
+        lines.append(f'hub_api_request_duration_seconds_sum{{{labels}}} {stats.latency}')
+
+    lines += ['# TYPE hub_api_requests counter', '# HELP hub_api_requests Requests to the API by status code.']
+    for (method, path), stats in endpoints:
+        for status, count in sorted(stats.statuses.items(), key=str):
+            lines.append(f'hub_api_requests_total{{method="{_label(method)}",endpoint="{_label(path)}",'
+                         f'status="{status}"}} {count}')
+
+    lines += ['# TYPE hub_api_response_bytes counter', '# HELP hub_api_response_bytes Bytes received from the API.']
+    for (method, path), stats in endpoints:
+        lines.append(f'hub_api_response_bytes_total{{method="{_label(method)}",endpoint="{_label(path)}"}} '
+                     f'{stats.bytes}')
+
+    lines += ['# TYPE hub_api_throttle_wait_seconds counter',
+              '# HELP hub_api_throttle_wait_seconds Time requests waited for the rate limiter.']
+    for (method, path), stats in endpoints:
+        lines.append(f'hub_api_throttle_wait_seconds_total{{method="{_label(method)}",endpoint="{_label(path)}"}} '
+                     f'{stats.throttled}')
+
+    return '\n'.join(lines + ['# EOF']) + '\n'
+
+
+def write_metrics(path):
+    '''Writes the metrics to <path>, replacing it at once so a scraper never reads half of it'''
+    temp_path = f'{path}.tmp-{os.getpid()}'
+    with open(temp_path, 'w') as file:
+        file.write(metrics())
+    os.replace(temp_path, path)
+
+
+def _at_exit():
+    if METRICS_FILE:
+        write_metrics(METRICS_FILE)
+    if _trace is not None:
+        _trace.close()
+    if SUMMARY:
+        print_summary()
+
+
+if ENABLED:
+    atexit.register(_at_exit)
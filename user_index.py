@@ -0,0 +1,66 @@
+# (C) Copyright IBM 2021.
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import threading
+import hub_snapshot
+
+# Latest index built by this process for each hub, with the version of the snapshot it was built from
+_indexes = {}
+_lock = threading.Lock()
+
+
+class UserIndex:
+    '''Index of the users of a hub, built in one pass over the /Network/{hub}/users data.
+
+        <ids> maps each email (lower case) to its userId. <memberships> maps each email to the set of
+        (group, project) pairs the user belongs to. Group admins are stored as (group, None) and hub admins
+        as (None, None). Deleted memberships are left out.'''
+
+    def __init__(self, data):
+        self.ids = {}
+        self.memberships = {}
+
+        self._add_users(data.get("users", {}), None, None)
+        for group_name, group in data.get("groups", {}).items():
+            self._add_users(group.get("users", {}), group_name, None)
+            for project_name, project in group.get("projects", {}).items():
+                if not project.get("deleted", False):
+                    self._add_users(project.get("users", {}), group_name, project_name)
+
+    def _add_users(self, users, group, project):
+        for user_id, user_data in users.items():
+            email = user_data["email"].lower()
+            self.ids.setdefault(email, user_id)
+            if not user_data.get("deleted", False):
+                self.memberships.setdefault(email, set()).add((group, project))
+
+    def user_id(self, email):
+        '''Returns the userId of <email>, or None if the user isn't in the hub'''
+        return self.ids.get(email.lower())
+
+    def is_member(self, email, group, project=None):
+        '''Returns True if <email> belongs to <project> in <group>, or is an admin of <group> if no project is given'''
+        return (group, project) in self.memberships.get(email.lower(), ())
+
+    def projects_of(self, email):
+        '''Returns the (group, project) pairs <email> is a collaborator of'''
+        return {membership for membership in self.memberships.get(email.lower(), ()) if membership[1] is not None}
+
+
+def get_user_index(hub, max_age=hub_snapshot.SNAPSHOT_TTL, offline=False):
+    '''Returns the UserIndex of <hub>. The index is built once per snapshot of the hub users and then reused'''
+    snapshot = hub_snapshot.get_snapshot(hub, '/users', max_age, offline)
+    version = snapshot['etag'] or snapshot['last_modified'] or snapshot['fetched']
+
+    with _lock:
+        if hub not in _indexes or _indexes[hub][0] != version:
+            _indexes[hub] = (version, UserIndex(snapshot['data']))
+
+        return _indexes[hub][1]